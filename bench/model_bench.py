@@ -0,0 +1,101 @@
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Measure memory and time for building and rendering a large dependency graph
+of WheelInfo/DependencyInfo structs, without pip or any wheel files.
+
+One in ten dependencies is platform specific (a linux and a macos wheel),
+each dependency has five subdependencies.
+
+Usage: PYTHONPATH=src python bench/model_bench.py [--wheels 10000] [--repeat 5]
+"""
+import argparse
+import gc
+import logging
+import random
+import time
+import tracemalloc
+
+from rules_pygen.rules_generator import (
+    DependencyInfo,
+    RequirementsToBazelLibGenerator,
+    WheelInfo,
+)
+
+
+def _build(count: int):
+    rnd = random.Random(0)
+    deps = set()
+    for i in range(count):
+        name = "package-{}".format(i)
+        version = "1.{}.0".format(i % 7)
+        subdeps = {"package-{}".format(rnd.randrange(count)) for _ in range(5)}
+        dependency = DependencyInfo(name, subdeps, {})
+        platforms = ["manylinux1_x86_64", "macosx_10_9_x86_64"] if i % 10 == 0 else ["any"]
+        for platform in platforms:
+            filename = "package_{}-{}-cp37-cp37m-{}.whl".format(i, version, platform)
+            dependency.add_wheel(
+                WheelInfo(
+                    "/wheels/" + filename,
+                    "https://files.example.org/" + filename,
+                    name.replace("-", "_"),
+                    version,
+                    sha256sum="0" * 64,
+                )
+            )
+        deps.add(dependency)
+    return deps
+
+
+def _best_of(repeat: int, func, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--wheels", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.getLogger("rules_pygen").setLevel(logging.WARNING)
+
+    build_time = _best_of(args.repeat, _build, args.wheels)
+
+    gc.collect()
+    tracemalloc.start()
+    deps = _build(args.wheels)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    gen = RequirementsToBazelLibGenerator(
+        "requirements.txt", None, "requirements.bzl", "//3rdparty/python", "37"
+    )
+    gen.fingerprint = lambda: "0" * 64  # no requirements file to hash
+    render_time = _best_of(args.repeat, gen.render, deps)
+
+    print("dependencies: {}".format(len(deps)))
+    print("build:        {:.0f} ms".format(build_time * 1000))
+    print("memory:       {:.1f} MB".format(memory / 1e6))
+    print("render:       {:.0f} ms".format(render_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Compare import times of N third party packages laid out as one sys.path
+entry per wheel (the "archives" layout) and as a single site-packages
+directory (the "site-packages" layout).
+
+Every import has to look through sys.path entries in order, so with one
+entry per wheel the number of stat calls grows with N squared. Stdlib
+modules imported after the third party paths are affected too, as Bazel
+puts its import paths in front.
+
+Usage: python bench/site_packages_bench.py [--deps 50 300] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# stdlib modules that are not imported at interpreter startup
+STDLIB_MODULES = ["decimal", "fractions", "json", "csv", "uuid", "dataclasses", "difflib"]
+
+IMPORT_SCRIPT = """
+import sys
+import time
+sys.path[:0] = {paths!r}
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+print(time.perf_counter() - start)
+"""
+
+
+def _make_packages(root: str, count: int):
+    """Create `count` packages, each in its own directory and in a shared one."""
+    per_wheel_paths = []
+    site_packages = os.path.join(root, "site-packages")
+    for i in range(count):
+        name = "pkg_{}".format(i)
+        wheel_path = os.path.join(root, "archives", "pypi__{}".format(name))
+        per_wheel_paths.append(wheel_path)
+        for base in (wheel_path, site_packages):
+            package_dir = os.path.join(base, name)
+            os.makedirs(package_dir)
+            with open(os.path.join(package_dir, "__init__.py"), "w") as f:
+                f.write("from {} import core\n".format(name))
+            with open(os.path.join(package_dir, "core.py"), "w") as f:
+                f.write("VALUE = {}\n".format(i))
+    return per_wheel_paths, [site_packages]
+
+
+def _time_imports(paths, modules, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, "-B", "-c", IMPORT_SCRIPT.format(paths=paths, modules=modules)],
+            universal_newlines=True,
+        )
+        timings.append(float(out))
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--deps", type=int, nargs="+", default=[50, 300])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("{:>6}  {:>14}  {:>14}  {:>8}".format("deps", "archives (ms)", "site-pkgs (ms)", "speedup"))
+    for count in args.deps:
+        with tempfile.TemporaryDirectory() as root:
+            per_wheel_paths, site_packages_paths = _make_packages(root, count)
+            modules = ["pkg_{}".format(i) for i in range(count)] + STDLIB_MODULES
+            archives = _time_imports(per_wheel_paths, modules, args.repeat)
+            site_packages = _time_imports(site_packages_paths, modules, args.repeat)
+        print(
+            "{:>6}  {:>14.1f}  {:>14.1f}  {:>7.1f}x".format(
+                count, archives * 1000, site_packages * 1000, archives / site_packages
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+# part of the fingerprint of generated files, bump it when the rendered output changes
+__version__ = "0.3.0"
+
+__all__ = ["check", "generate"]
+
+
+def __getattr__(name):
+    # the API is imported on first use, importing the package has no side effects
+    if name in __all__:
+        from rules_pygen import api
+
+        return getattr(api, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
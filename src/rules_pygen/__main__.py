@@ -14,20 +14,37 @@
 # limitations under the License.
 #
 import argparse
-import errno
 import logging
 import os
-import shutil
 import sys
-import tempfile
 
-from rules_pygen.rules_generator import RequirementsToBazelLibGenerator
+from rules_pygen.api import check, generate
+from rules_pygen.rules_generator import (
+    LAYOUT_ARCHIVES,
+    LAYOUTS,
+    PLATFORMS,
+    RESOLVER_PIP_WHEEL,
+    RESOLVERS,
+    PrunePolicy,
+)
 
 
 logger = logging.getLogger(__name__)
 
 
+def shard_arg(value):
+    """Parse a shard like "2/4" """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid shard {}, should be like 2/4".format(value))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("Invalid shard {}, should be like 2/4".format(value))
+    return index, count
+
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
     parser = argparse.ArgumentParser(description="Bazel Python rules generator.", prog="generator")
     parser.add_argument(
         "requirements-file", action="store", help="Absolute path to the requirements.txt file"
@@ -48,12 +65,119 @@ if __name__ == "__main__":
         help="Path to a directory to store wheels. A temporary directory will"
         " be created for you (and removed) if you do not specify this",
     )
+    parser.add_argument(
+        "--wheel-dir-budget",
+        action="store",
+        type=float,
+        help="Megabytes of wheels no longer used (old versions, removed requirements) to"
+        " keep in --wheel-dir, the least recently used beyond that are removed",
+    )
     parser.add_argument(
         "--python",
         action="store",
         help='The version of python to use, example: "37"',
         default="37",
     )
+    parser.add_argument(
+        "--precompile",
+        action="store_true",
+        help="Compile the sources of each library to bytecode when Bazel fetches it, so"
+        " that tests don't compile them on every start. Needs the python version to be"
+        " available where Bazel runs",
+    )
+    parser.add_argument(
+        "--prune-config",
+        action="store",
+        help="Path to a JSON prune policy with glob patterns of files (tests, docs, C"
+        " sources...) to leave out of the libraries, see PrunePolicy",
+    )
+    parser.add_argument(
+        "--prune-report",
+        action="store",
+        help="Path to write a CSV report of the files and bytes pruned from each archive",
+    )
+    parser.add_argument(
+        "--weight-report",
+        action="store",
+        help="Path to write a CSV report of the files and (compressed and uncompressed) bytes"
+        " of each dependency and its transitive dependencies, per platform",
+    )
+    parser.add_argument(
+        "--layout",
+        action="store",
+        choices=LAYOUTS,
+        default=LAYOUT_ARCHIVES,
+        help="How to lay out the wheels: an archive (and sys.path entry) per wheel, or"
+        " all wheels for the host platform in a single site-packages repository",
+    )
+    parser.add_argument(
+        "--module-index",
+        action="store",
+        help="Path to write a JSON index of the modules each distribution provides, for"
+        " use with rules_pygen.import_audit",
+    )
+    parser.add_argument(
+        "--resolver",
+        action="store",
+        choices=RESOLVERS,
+        default=RESOLVER_PIP_WHEEL,
+        help="How to resolve the requirements: pip wheel (builds wheels for sdists,"
+        " finds other platforms' wheels in pip's logs) or pip's JSON installation"
+        " report (wheels only, pip 22.2+, downloads without building anything)",
+    )
+    parser.add_argument(
+        "--platform",
+        action="append",
+        dest="platforms",
+        choices=PLATFORMS,
+        help="With --resolver=pip-report, a platform to resolve the requirements for."
+        " Repeat for several platforms, each is resolved by its own pip process in"
+        " parallel. Defaults to all of {}".format(", ".join(PLATFORMS)),
+    )
+    parser.add_argument(
+        "--repository-cache",
+        action="store",
+        help="Path to a Bazel --repository_cache directory to put the wheels in, so that"
+        " Bazel does not download them again",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        help="Path to a directory to cache HTTP responses in. Wheels (and pip's index pages)"
+        " are revalidated with their ETag/Last-Modified instead of downloaded again",
+    )
+    parser.add_argument(
+        "--mirror-url",
+        action="store",
+        help="URL prefix of a mirror of the wheels. The archives list the mirror URL of each"
+        " wheel first and the URL of the index as fallback",
+    )
+    parser.add_argument(
+        "--mirror-dir",
+        action="store",
+        help="Path to a directory to copy the wheels to, to be served at --mirror-url."
+        " Wheels that are already there are not copied again",
+    )
+    parser.add_argument(
+        "--shard",
+        action="store",
+        type=shard_arg,
+        help='Only resolve shard K/N (e.g. "2/4") of the requirements and write the partial'
+        " result to --partial-output instead of the bazel rules file. Merge the partial"
+        " results of all shards with rules_pygen.merge",
+    )
+    parser.add_argument(
+        "--partial-output",
+        action="store",
+        help="Path to write the resolved dependencies, wheels and hashes to as JSON",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only check that the bazel rules file is up to date with the requirements"
+        " file, exit with a non-zero status if it is not. Does not call pip or use"
+        " the network",
+    )
 
     pargs = parser.parse_args()
     args_lookup = vars(pargs)
@@ -65,21 +189,44 @@ if __name__ == "__main__":
         sys.stdout.write("Invalid bazel-library-path. Should be like //3rdparty/python/mylib\n")
         sys.exit(1)
 
-    uses_temp = False
-    if not pargs.wheel_dir:
-        wheel_dir = tempfile.mkdtemp()
-        uses_temp = True
-    else:
-        wheel_dir = os.path.abspath(pargs.wheel_dir)
-        try:
-            os.makedirs(wheel_dir)
-        except OSError as e:
-            if e.errno == errno.EEXIST and os.path.isdir(wheel_dir):
-                pass
-            else:
-                raise
+    # options that affect the output, and so have to be the same for --check
+    options = dict(
+        precompile=pargs.precompile,
+        prune_policy=PrunePolicy.from_file(pargs.prune_config) if pargs.prune_config else None,
+        layout=pargs.layout,
+        resolver=pargs.resolver,
+        platforms=tuple(sorted(set(pargs.platforms))) if pargs.platforms else PLATFORMS,
+        mirror_url=pargs.mirror_url,
+    )
+
+    if pargs.shard and not pargs.partial_output:
+        sys.stdout.write("--shard needs --partial-output\n")
+        sys.exit(1)
+
+    if pargs.check:
+        if not check(reqs_txt, bzl_file, bzl_path, pargs.python, **options):
+            sys.stdout.write("{} is out of date\n".format(bzl_file))
+            sys.exit(1)
+        sys.exit(0)
 
-    gen = RequirementsToBazelLibGenerator(reqs_txt, wheel_dir, bzl_file, bzl_path, pargs.python)
-    gen.run()
-    if uses_temp:
-        shutil.rmtree(wheel_dir)
+    generate(
+        reqs_txt,
+        bzl_path,
+        pargs.python,
+        output_file=None if pargs.shard else bzl_file,
+        wheel_dir=pargs.wheel_dir,
+        wheel_dir_budget=(
+            int(pargs.wheel_dir_budget * 1024 * 1024)
+            if pargs.wheel_dir_budget is not None
+            else None
+        ),
+        prune_report=pargs.prune_report,
+        weight_report=pargs.weight_report,
+        module_index=pargs.module_index,
+        repository_cache=pargs.repository_cache,
+        cache_dir=pargs.cache_dir,
+        mirror_dir=pargs.mirror_dir,
+        shard=pargs.shard,
+        partial_output=pargs.partial_output,
+        **options
+    )
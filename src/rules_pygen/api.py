@@ -0,0 +1,91 @@
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Library API of the generator, for tooling that runs it in process.
+
+    from rules_pygen import generate
+
+    result = generate("3rdparty/python/requirements.txt", "//3rdparty/python")
+    for dependency in result.dependencies:
+        print(dependency.name, dependency.dependencies, dependency.wheels)
+    print(result.hashes)
+    print(result.text)
+
+Keyword arguments are passed on to RequirementsToBazelLibGenerator, see
+there for the options (precompile, prune_policy, layout, resolver, ...).
+"""
+import os
+import shutil
+import tempfile
+import typing
+
+from rules_pygen.rules_generator import (
+    GenerationResult,
+    ProgressCallback,
+    RequirementsToBazelLibGenerator,
+)
+
+
+def generate(
+    requirements_path: str,
+    bzl_path: str,
+    python: str = "37",
+    output_file: typing.Optional[str] = None,
+    wheel_dir: typing.Optional[str] = None,
+    progress: typing.Optional[ProgressCallback] = None,
+    **options
+) -> GenerationResult:
+    """Resolve `requirements_path` and render the bzl file for it
+
+    The bzl file is only written if there is an `output_file`, the text is
+    always part of the result. Without a `wheel_dir` the wheels are
+    downloaded to a temporary directory that is removed again, so the
+    `filepath` of the resulting wheels is only usable with a `wheel_dir`.
+    """
+    uses_temp = wheel_dir is None
+    if uses_temp:
+        wheel_dir = tempfile.mkdtemp()
+    else:
+        os.makedirs(wheel_dir, exist_ok=True)
+    try:
+        gen = RequirementsToBazelLibGenerator(
+            os.path.abspath(requirements_path),
+            os.path.abspath(wheel_dir),
+            os.path.abspath(output_file) if output_file else None,
+            bzl_path,
+            python,
+            progress=progress,
+            **options
+        )
+        return gen.run()
+    finally:
+        if uses_temp:
+            shutil.rmtree(wheel_dir)
+
+
+def check(
+    requirements_path: str, output_file: str, bzl_path: str, python: str = "37", **options
+) -> bool:
+    """Whether `output_file` is up to date with `requirements_path` and the options"""
+    gen = RequirementsToBazelLibGenerator(
+        os.path.abspath(requirements_path),
+        None,
+        os.path.abspath(output_file),
+        bzl_path,
+        python,
+        **options
+    )
+    return gen.check()
@@ -0,0 +1,62 @@
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Writing files that others may be reading at the same time.
+
+The output file, the wheel mirror, Bazel's repository cache and the HTTP
+cache can all be read while the generator writes to them. Files are written
+to a temporary file next to their destination and moved in place, so readers
+see the old file or the new one, never half of it.
+"""
+import os
+import shutil
+import tempfile
+import typing
+
+
+def _write_atomically(
+    dest: str, write: typing.Callable[[str], None], mode: typing.Optional[int]
+) -> None:
+    """Call `write` with a temporary path next to `dest`, then move it to `dest`"""
+    f = tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(os.path.abspath(dest)),
+        prefix=".{}.".format(os.path.basename(dest)),
+        delete=False,
+    )
+    f.close()
+    try:
+        write(f.name)
+        if mode is not None:
+            os.chmod(f.name, mode)
+        os.replace(f.name, dest)
+    except BaseException:
+        os.remove(f.name)
+        raise
+
+
+def atomic_copy(src: str, dest: str, mode: typing.Optional[int] = None) -> None:
+    """Copy the file at `src` to `dest`, with permission bits `mode` if given"""
+    _write_atomically(dest, lambda path: shutil.copyfile(src, path), mode)
+
+
+def atomic_write(dest: str, content: str, mode: typing.Optional[int] = None) -> None:
+    """Write the text `content` to `dest`, with permission bits `mode` if given"""
+
+    def write(path):
+        with open(path, "wt") as f:
+            f.write(content)
+
+    _write_atomically(dest, write, mode)
@@ -0,0 +1,157 @@
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+On-disk cache of HTTP responses.
+
+The generator keeps the bodies it downloads together with their ETag and
+Last-Modified validators. The next run revalidates a cached body with a
+conditional request (If-None-Match/If-Modified-Since); if the server does
+not answer 304 Not Modified, the body of that response replaces the cached
+one. Entries are keyed by a hash of the URL. A cached body that matches the
+digest the index gives for it is used without asking the server at all.
+
+pip gets a directory in the same cache for its own HTTP cache, which does
+the same for index pages and metadata.
+"""
+import hashlib
+import http.client
+import json
+import logging
+import os
+import threading
+import typing
+import urllib.error
+import urllib.request
+
+from rules_pygen.fileutil import atomic_copy, atomic_write
+
+
+logger = logging.getLogger(__name__)
+
+
+HTTP_DIR = "http"
+PIP_DIR = "pip"
+
+# outcomes of a cache lookup
+HIT = "hit"  # cached body with a matching digest, no request made
+NOT_MODIFIED = "not_modified"  # revalidated, the server answered 304
+MISS = "miss"  # not cached or changed, the body was downloaded
+
+
+class CacheEntry:
+    """Struct for a cached response body and its validators"""
+
+    __slots__ = ("path", "etag", "last_modified")
+
+    def __init__(self, path, etag=None, last_modified=None):
+        self.path = path
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def conditional_headers(self) -> typing.Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """Cache of HTTP response bodies in `directory`, keyed by URL"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.stats = {HIT: 0, NOT_MODIFIED: 0, MISS: 0}
+        self._lock = threading.Lock()  # downloads run in threads
+        os.makedirs(os.path.join(directory, HTTP_DIR), exist_ok=True)
+
+    @property
+    def pip_cache_dir(self) -> str:
+        """Directory for pip's --cache-dir"""
+        return os.path.join(self.directory, PIP_DIR)
+
+    def _paths(self, url: str) -> typing.Tuple[str, str]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, HTTP_DIR, key)
+        return base + ".body", base + ".json"
+
+    def lookup(self, url: str) -> typing.Optional[CacheEntry]:
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, "rt") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url or not os.path.exists(body_path):
+            return None
+        return CacheEntry(body_path, meta.get("etag"), meta.get("last_modified"))
+
+    def revalidate(
+        self, url: str, entry: CacheEntry, timeout: float
+    ) -> typing.Tuple[bool, typing.Optional[http.client.HTTPResponse]]:
+        """Ask the server whether the cached body for `url` is still current
+
+        Returns (True, None) if it is. If it changed, the open response with
+        the new body and its validators is returned as (False, response) for
+        the caller to read and close. (False, None) means the entry has no
+        validators or the server could not be asked, the caller downloads the
+        body again then.
+        """
+        headers = entry.conditional_headers()
+        if not headers:
+            return False, None
+        request = urllib.request.Request(url, headers=headers)
+        try:
+            response = urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                logger.info("Not modified %s", url)
+                return True, None
+            logger.debug("Revalidating %s failed: %s", url, e)
+            return False, None
+        except (OSError, http.client.HTTPException) as e:
+            logger.debug("Revalidating %s failed: %s", url, e)
+            return False, None
+        logger.info("Changed %s", url)
+        return False, response
+
+    def store(self, url: str, filepath: str, headers) -> None:
+        """Add a copy of `filepath` as the body of `url` with the validators in `headers`"""
+        body_path, meta_path = self._paths(url)
+        meta = {
+            "url": url,
+            "etag": headers.get("ETag") if headers else None,
+            "last_modified": headers.get("Last-Modified") if headers else None,
+        }
+        atomic_copy(filepath, body_path)
+        atomic_write(meta_path, json.dumps(meta))
+
+    def record(self, outcome: str) -> None:
+        with self._lock:
+            self.stats[outcome] += 1
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = sum(self.stats.values())
+        if not lookups:
+            return 0.0
+        return (self.stats[HIT] + self.stats[NOT_MODIFIED]) / lookups
+
+    def summary(self) -> str:
+        return "{} hits, {} not modified, {} misses (hit ratio {:.0%})".format(
+            self.stats[HIT], self.stats[NOT_MODIFIED], self.stats[MISS], self.hit_ratio
+        )
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Find unused and missing third party requirements.
+
+This reads the module index written by the generator (`--module-index`),
+which maps the modules each wheel provides to its distribution, and scans
+the Python sources of a repository for imports:
+
+* requirements that no source imports, directly or through the
+  dependencies of an imported distribution, are reported as unused
+* imports that are neither first party, stdlib, nor provided by any
+  distribution in the index are reported as missing
+
+Usage:
+
+    python -m rules_pygen.import_audit modules.json requirements.txt src/ component_a/
+"""
+import argparse
+import ast
+import json
+import logging
+import os
+import re
+import sys
+import sysconfig
+import typing
+
+from rules_pygen.rules_generator import requirements_files
+
+
+logger = logging.getLogger(__name__)
+
+
+REQUIREMENT_NAME_RE = re.compile(r"^\s*(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)")
+
+# directories that never contain sources of the repository itself
+SKIPPED_DIRS = {"__pycache__", "node_modules"}
+
+
+class AuditResult:
+    """Struct for the outcome of an audit."""
+
+    def __init__(self, unused, missing):
+        self.unused = unused  # requirement names
+        self.missing = missing  # module name -> files importing it
+
+    def __bool__(self):
+        return bool(self.unused or self.missing)
+
+
+def _normalize(name: str) -> str:
+    return name.replace("-", "_").lower()
+
+
+def read_requirements(requirements_path: str) -> typing.Set[str]:
+    """Return the (normalized) names of the requirements in a requirements file"""
+    names = set()
+    for path in requirements_files(requirements_path):
+        with open(path, "rt") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if not line or line.startswith("-"):
+                    continue
+                match = REQUIREMENT_NAME_RE.match(line)
+                if match:
+                    names.add(_normalize(match.group("name")))
+    return names
+
+
+def _stdlib_modules() -> typing.Set[str]:
+    if hasattr(sys, "stdlib_module_names"):  # python3.10+
+        return set(sys.stdlib_module_names)
+    modules = set(sys.builtin_module_names)
+    stdlib = sysconfig.get_paths()["stdlib"]
+    for path in (stdlib, os.path.join(stdlib, "lib-dynload")):
+        for entry in os.listdir(path):
+            name = entry.split(".")[0]
+            if entry.endswith((".py", ".so")) or os.path.isfile(
+                os.path.join(path, entry, "__init__.py")
+            ):
+                modules.add(name)
+    return modules
+
+
+def _source_files(roots: typing.Iterable[str]) -> typing.Iterator[typing.Tuple[str, str]]:
+    """The Python files in `roots` as (root, path) pairs"""
+    for root in roots:
+        root = os.path.normpath(root)
+        if os.path.isfile(root):
+            yield root, root
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(
+                d
+                for d in dirnames
+                if d not in SKIPPED_DIRS and not d.startswith((".", "bazel-"))
+            )
+            for filename in sorted(filenames):
+                if filename.endswith(".py"):
+                    yield root, os.path.join(dirpath, filename)
+
+
+def _first_party_modules(files: typing.Iterable[typing.Tuple[str, str]]) -> typing.Set[str]:
+    """Names of the modules and packages in the scanned sources.
+
+    We don't know the import roots of every library, so any module or
+    package name in a scanned root (or the root itself) counts as first party.
+    The directories above a root don't, a checkout in `~/requests/` does not
+    make `requests` first party.
+    """
+    modules = set()
+    for root, path in files:
+        parts = os.path.relpath(path, os.path.dirname(root)).split(os.sep)
+        modules.update(parts[:-1])
+        modules.add(parts[-1][:-3])
+    return modules
+
+
+def _imports(path: str) -> typing.List[typing.Tuple[str, ...]]:
+    """Return the absolute imports of a source file
+
+    Each import is a tuple of the module names it could refer to, most
+    specific first: `from google import protobuf` could import the module
+    `google.protobuf` or the name `protobuf` from `google`.
+    """
+    with open(path, "rb") as f:
+        try:
+            tree = ast.parse(f.read(), filename=path)
+        except (SyntaxError, ValueError) as e:
+            logger.warning("Could not parse %s: %s", path, e)
+            return []
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend((alias.name,) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = ["{}.{}".format(node.module, alias.name) for alias in node.names]
+            imports.append(tuple(names) + (node.module,))
+    return imports
+
+
+def _distributions(module: str, index: typing.Dict[str, typing.List[str]]) -> typing.List[str]:
+    """Look up the distributions for `module`, longest dotted prefix first"""
+    parts = module.split(".")
+    for i in range(len(parts), 0, -1):
+        distributions = index.get(".".join(parts[:i]))
+        if distributions:
+            return distributions
+    return []
+
+
+def _closure(names: typing.Iterable[str], graph: typing.Dict[str, typing.List[str]]) -> set:
+    seen = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in seen:
+            seen.add(name)
+            pending.extend(graph.get(name, []))
+    return seen
+
+
+def audit(index: dict, requirements: typing.Set[str], roots: typing.List[str]) -> AuditResult:
+    files = list(_source_files(roots))
+    first_party = _first_party_modules(files)
+    stdlib = _stdlib_modules()
+    module_index = index["modules"]
+
+    imported = set()
+    missing = {}
+    for _, path in files:
+        for candidates in _imports(path):
+            distributions = set()
+            for module in candidates:
+                distributions.update(_distributions(module, module_index))
+            if distributions:
+                imported.update(distributions)
+                continue
+            top_level = candidates[-1].split(".")[0]
+            if top_level in first_party or top_level in stdlib or top_level == "__future__":
+                continue
+            missing.setdefault(top_level, set()).add(path)
+
+    used = _closure(imported, index["dependencies"])
+    unused = sorted(name for name in requirements if name not in used)
+    return AuditResult(unused, {module: sorted(paths) for module, paths in missing.items()})
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG)
+    parser = argparse.ArgumentParser(
+        description="Find unused and missing third party requirements.",
+        prog="import_audit",
+    )
+    parser.add_argument("module-index", help="Path to the module index from --module-index")
+    parser.add_argument("requirements-file", help="Path to the requirements.txt file")
+    parser.add_argument("sources", nargs="+", help="Source directories or files to scan")
+    pargs = parser.parse_args()
+    args_lookup = vars(pargs)
+
+    with open(args_lookup["module-index"], "rt") as f:
+        index = json.load(f)
+    requirements = read_requirements(args_lookup["requirements-file"])
+    result = audit(index, requirements, pargs.sources)
+
+    for name in result.unused:
+        sys.stdout.write("unused requirement: {}\n".format(name))
+    for module, paths in sorted(result.missing.items()):
+        sys.stdout.write(
+            "missing requirement for {} (imported in {})\n".format(module, ", ".join(paths))
+        )
+    sys.exit(1 if result else 0)
+
+
+if __name__ == "__main__":
+    main()
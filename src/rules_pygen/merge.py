@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Merge the partial results of sharded generator runs into the bzl file.
+
+Each shard (`--shard K/N --partial-output shard-K.json`) resolves a slice of
+the requirements file and writes the dependencies, their wheels and hashes as
+JSON. This checks that the shards are complete and agree with each other:
+
+* all shards of one run are there, each once, with the same options
+* the requirements file did not change since the shards ran
+* a dependency resolved by several shards has the same version (pin it if
+  not) and its wheels have the same hashes
+
+and renders the bzl file from the union, the same as an unsharded run.
+
+Usage:
+
+    python -m rules_pygen.merge requirements.txt requirements.bzl shard-*.json
+"""
+import argparse
+import json
+import logging
+import operator
+import os
+import sys
+import typing
+
+from rules_pygen.rules_generator import (
+    PARTIAL_FORMAT,
+    DependencyInfo,
+    GenerationResult,
+    PrunePolicy,
+    PyBazelRuleGeneratorException,
+    RequirementsToBazelLibGenerator,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_partial(path: str) -> dict:
+    with open(path, "rt") as f:
+        partial = json.load(f)
+    if partial.get("format") != PARTIAL_FORMAT:
+        raise PyBazelRuleGeneratorException(
+            "{} is not a partial result of this generator version".format(path)
+        )
+    return partial
+
+
+def _check_shards(partials: typing.List[dict]) -> None:
+    counts = {partial["shard"][1] for partial in partials}
+    if len(counts) != 1:
+        raise PyBazelRuleGeneratorException(
+            "Partial results of different shardings: {}".format(sorted(counts))
+        )
+    indexes = sorted(partial["shard"][0] for partial in partials)
+    expected = list(range(1, counts.pop() + 1))
+    if indexes != expected:
+        raise PyBazelRuleGeneratorException(
+            "Expected shards {}, got {}".format(expected, indexes)
+        )
+    for key in ("options", "fingerprint"):
+        if len({json.dumps(partial[key], sort_keys=True) for partial in partials}) != 1:
+            raise PyBazelRuleGeneratorException(
+                "Shards were run with different {}".format(key)
+            )
+
+
+def _merge_dependency(merged: DependencyInfo, other: DependencyInfo, shard: int) -> None:
+    """Add what `other` (from `shard`) knows about the same dependency to `merged`"""
+    version, other_version = merged.wheels[0].version, other.wheels[0].version
+    if version != other_version:
+        raise PyBazelRuleGeneratorException(
+            "{} resolves to {} and to {} (shard {}), pin it".format(
+                merged.name, version, other_version, shard
+            )
+        )
+    hashes = {wheel.filename: wheel.sha256sum for wheel in merged.wheels}
+    for wheel in other.wheels:
+        if hashes.get(wheel.filename, wheel.sha256sum) != wheel.sha256sum:
+            raise PyBazelRuleGeneratorException(
+                "{} has different hashes in shard {}".format(wheel.filename, shard)
+            )
+        merged.add_wheel(wheel)
+    merged.dependencies = sorted(set(merged.dependencies) | set(other.dependencies))
+    for platform, platform_deps in other.platform_dependencies.items():
+        merged.platform_dependencies[platform] = sorted(
+            set(merged.platform_dependencies.get(platform, [])) | set(platform_deps)
+        )
+    for extra, extra_deps in other.extras.items():
+        merged.extras[extra] = sorted(set(merged.extras.get(extra, [])) | set(extra_deps))
+    merged.modules = sorted(set(merged.modules) | set(other.modules))
+
+
+def merge(partials: typing.List[dict]) -> typing.List[DependencyInfo]:
+    """Deduplicate the dependencies of `partials`, sorted by name"""
+    _check_shards(partials)
+    deps = {}  # type: typing.Dict[str, DependencyInfo]
+    for partial in sorted(partials, key=lambda partial: partial["shard"][0]):
+        for data in partial["dependencies"]:
+            dependency = DependencyInfo.from_dict(data)
+            if dependency.name in deps:
+                _merge_dependency(deps[dependency.name], dependency, partial["shard"][0])
+            else:
+                deps[dependency.name] = dependency
+    return sorted(deps.values(), key=operator.attrgetter("name"))
+
+
+def merge_files(
+    requirements_path: str, output_file: str, partial_paths: typing.List[str]
+) -> GenerationResult:
+    """Merge the partial results at `partial_paths` and write the bzl file"""
+    partials = [read_partial(path) for path in partial_paths]
+    deps = merge(partials)
+
+    options = dict(partials[0]["options"])
+    if options["prune_policy"] is not None:
+        options["prune_policy"] = PrunePolicy(**options["prune_policy"])
+    gen = RequirementsToBazelLibGenerator(
+        os.path.abspath(requirements_path), None, os.path.abspath(output_file), **options
+    )
+    fingerprint = gen.fingerprint()
+    if fingerprint != partials[0]["fingerprint"]:
+        raise PyBazelRuleGeneratorException(
+            "{} changed since the shards ran, run them again".format(requirements_path)
+        )
+    text = gen.render(deps)
+    gen._write_output_file(text)
+    return GenerationResult(deps, text, fingerprint)
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG)
+    parser = argparse.ArgumentParser(
+        description="Merge the partial results of sharded generator runs.",
+        prog="merge",
+    )
+    parser.add_argument("requirements-file", help="Path to the requirements.txt file")
+    parser.add_argument("bazel-rules-file", help="Path to the file to store Skylark build rules")
+    parser.add_argument("partials", nargs="+", help="Partial results of all shards")
+    pargs = parser.parse_args()
+    args_lookup = vars(pargs)
+
+    try:
+        result = merge_files(
+            args_lookup["requirements-file"], args_lookup["bazel-rules-file"], pargs.partials
+        )
+    except PyBazelRuleGeneratorException as e:
+        sys.stdout.write("{}\n".format(e))
+        sys.exit(1)
+    sys.stdout.write(
+        "Merged {} dependencies from {} shards\n".format(
+            len(result.dependencies), len(pargs.partials)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
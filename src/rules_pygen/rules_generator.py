@@ -21,49 +21,65 @@ a directory `wheel_dir` as well as subdependency wheels. We then parse each
 wheel for dependencies (this uses wheeltool.py). Then with the dependencies
 we create `output_file` which can be called from the WORKSPACE.
 
-TODO:
-* What about 'extras'? Extras are essentially alternative versions of the original
-library that contain additional dependencies:
+Extras are essentially alternative versions of the original library that
+contain additional dependencies, they get a library of their own:
      foo = requires {'bar'},           ==> py_library('foo', deps = ['bar'])
-     foo[baz] = requires {'baz'}       ==> py_library('foo__baz', deps = ['bar', 'baz'])
---> For now this generator *does not* contain support for extras.
+     foo[baz] = requires {'baz'}       ==> py_library('foo__baz', deps = ['foo', 'baz'])
+Only extras whose dependencies were resolved (requested by some requirement)
+get a library.
 """
 
+import collections
+import concurrent.futures
+import csv
 import glob
 import hashlib
+import http.client
+import io
+import json
 import logging
 import operator
 import os
 import pathlib
 import re
-import shlex
 import shutil
 import subprocess
+import sys
 import tempfile
 import time
 import typing
+import urllib.error
+import urllib.parse
 import urllib.request
+import zipfile
 
+import pkg_resources
+
+from rules_pygen import __version__
+from rules_pygen import http_cache
+from rules_pygen.fileutil import atomic_copy, atomic_write
 from rules_pygen.wheeltool import Wheel
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
 HEADER = """# AUTO GENERATED. DO NOT EDIT DIRECTLY.
 #
 # Generated with https://github.com/tubular/rules_pygen
+# Fingerprint: {fingerprint}
 #
 load("@bazel_tools//tools/build_defs/repo:http.bzl", "http_archive")
 load("@rules_python//python:defs.bzl", "py_library")
+"""
 
-_BUILD_FILE_CONTENT='''
+BUILD_FILE_TMPL = """
+{constant}='''
 
 py_library(
     name = "pkg",
-    srcs = glob(["**/*.py"]),
+    srcs = glob(["**/*.py"]{srcs_exclude}),
     data = glob(["**/*"], exclude=[
-        "**/*.py", "BUILD", "BUILD.bazel", "WORKSPACE", "*.whl.zip", "**/*.ipynb"
+        "**/*.py", "BUILD", "BUILD.bazel", "WORKSPACE", "*.whl.zip", "**/*.ipynb"{data_exclude}
     ]),
     imports = ["."],
     visibility = ["//visibility:public"],
@@ -71,17 +87,115 @@ py_library(
 '''
 """
 
+BUILD_FILE_CONSTANT = "_BUILD_FILE_CONTENT"
+
+LAYOUT_ARCHIVES = "archives"
+LAYOUT_SITE_PACKAGES = "site-packages"
+LAYOUTS = (LAYOUT_ARCHIVES, LAYOUT_SITE_PACKAGES)
+
+# With the site-packages layout, all wheels for the host platform are extracted into a
+# single repository, so a binary gets one sys.path entry for all its third party deps
+# instead of one per wheel.
+SITE_PACKAGES_RULE = """
+def _pypi_site_packages_impl(repository_ctx):
+    if repository_ctx.os.name.lower().startswith("mac"):
+        host_platform = "macos"
+    else:
+        host_platform = "linux"
+    for wheel in repository_ctx.attr.wheels.values():
+        url, sha256, platform = wheel[:3]
+        if platform in ("purelib", host_platform):
+            # mirrors of the (origin) url come after it, but are tried first
+            repository_ctx.download_and_extract(
+                wheel[3:] + [url],
+                sha256 = sha256,
+                type = "zip",
+                canonical_id = url,
+            )
+    for cmd in repository_ctx.attr.patch_cmds:
+        result = repository_ctx.execute(["bash", "-c", cmd])
+        if result.return_code != 0:
+            fail("Command {} failed: {}".format(cmd, result.stderr))
+    repository_ctx.file("BUILD.bazel", repository_ctx.attr.build_file_content)
+
+_pypi_site_packages = repository_rule(
+    implementation = _pypi_site_packages_impl,
+    attrs = {
+        "wheels": attr.string_list_dict(),
+        "build_file_content": attr.string(),
+        "patch_cmds": attr.string_list(),
+    },
+)
+"""
+
+SITE_PACKAGES_LIBRARY_TMPL = """
+py_library(
+    name = "{name}",
+    srcs = glob({srcs}{srcs_exclude}),
+    data = glob({data}, exclude=[
+        "**/*.py"{data_exclude}
+    ]),
+    imports = ["."],
+    visibility = ["//visibility:public"],
+)
+"""
+
+SITE_PACKAGES_TMPL = """
+    if "{repository_name}" not in existing_rules:
+        _pypi_site_packages(
+            name = "{repository_name}",
+            wheels = {{
+{wheels}            }},
+            build_file_content = _SITE_PACKAGES_BUILD_FILE_CONTENT,
+{extra_attrs}        )
+"""
+
 FOOTER = """
 
 def requirement(name):
     name_key = name.replace("-", "_").lower()  # allow use of dashes and uppercase
+    if name_key.endswith("]"):  # an extra, "foo[bar]" is "foo__bar"
+        name_key, extra = name_key[:-1].split("[")
+        if "," in extra:
+            fail("{{}}: one extra at a time, e.g. requirement('foo[a]')".format(name))
+        # like the generator, runs of "-", "_" and "." in the extra become one "_"
+        extra = extra.strip().replace(".", "_")
+        for _ in range(len(extra)):
+            if "__" not in extra:
+                break
+            extra = extra.replace("__", "_")
+        name_key = "{{}}__{{}}".format(name_key, extra)
     return "{}:{{}}".format(name_key)
 """
 
+FINGERPRINT_RE = re.compile(r"^# Fingerprint: (?P<fingerprint>[0-9a-f]+)$", re.MULTILINE)
+
+# requirements.txt lines that pull in other files, these are part of the fingerprint
+NESTED_REQUIREMENTS_RE = re.compile(
+    r"^\s*(-r|--requirement|-c|--constraint)(\s+|=)(?P<path>\S+)"
+)
+
+# comments in requirements files, "#" only starts one at the start of a line or
+# after whitespace, see pip's req_file.py
+REQUIREMENTS_COMMENT_RE = re.compile(r"(^|\s+)#.*$")
+
+# editable requirements are requirements, not global options
+EDITABLE_REQUIREMENT_RE = re.compile(r"^(-e|--editable)(\s+|=)")
+
 # this matches *.whl files in log lines, note that PyPI can also contain
 # tar.gz files (not everything is a wheel) and so this script should deal
 # with those as well
-WHEEL_LINK_RE = re.compile(r"^\s*(Found|Skipping) link.*(?P<link>https?:[^ #]+\.whl)")
+WHEEL_LINK_RE = re.compile(
+    r"^\s*(Found|Skipping) link.*(?P<link>https?:[^ #]+\.whl)"
+    r"(#(?P<digest_algo>\w+)=(?P<digest>[0-9a-fA-F]+))?"
+)
+
+# log lines for the wheels pip put into the wheel dir on this run, downloaded,
+# found there already or built from an sdist
+PIP_WHEEL_FILE_RE = re.compile(
+    r"^\s*((Saved|File was already downloaded) (?P<path>.+\.whl)"
+    r"|Created wheel for \S+: filename=(?P<filename>\S+\.whl))"
+)
 
 WHEEL_FILENAME_RE = re.compile(r"^.*/(?P<filename>[^\/]*.whl)$")
 
@@ -96,18 +210,100 @@ ARCHIVE_TMPL = """
     if "{archive_name}" not in existing_rules:
         http_archive(
             name = "{archive_name}",
-            urls = ["{url}"],
+            urls = {urls},
             sha256 = "{sha256}",
-            build_file_content = _BUILD_FILE_CONTENT,
+            canonical_id = "{url}",
+            build_file_content = {build_file_content},
             type = "zip",
-        )
+{extra_attrs}        )
+"""
+
+# version of the partial result format written by shards, see merge.py
+PARTIAL_FORMAT = 2
+
+# Bazel's repository cache stores downloads by content at
+# <cache>/content_addressable/sha256/<sha256>/file. An entry is only used for a
+# download with a canonical_id if there is also an empty id-<sha256 of the id>
+# file next to it.
+REPOSITORY_CACHE_DIR = os.path.join("content_addressable", "sha256")
+REPOSITORY_CACHE_FILE = "file"
+REPOSITORY_CACHE_ID_PREFIX = "id-"
+
+# Compiles the archive's sources at fetch time so that tests and binaries don't have to
+# compile them on every start in a fresh sandbox. Hash based pycs (python3.7+) stay valid
+# regardless of the mtimes of the symlinks Bazel creates. Some wheels ship files that
+# don't compile (python2-only tests, templates), those are simply left without a pyc. A
+# missing interpreter fails the fetch instead of silently leaving every file without one.
+PRECOMPILE_CMD = (
+    "command -v {python} > /dev/null"
+    " || {{ echo 'precompiling needs {python} on the PATH' >&2; exit 1; }}; "
+    "{python} -m compileall -q -j 0 {options}. > /dev/null || true"
+)
+
+RESOLVER_PIP_WHEEL = "pip-wheel"
+RESOLVER_PIP_REPORT = "pip-report"
+RESOLVERS = (RESOLVER_PIP_WHEEL, RESOLVER_PIP_REPORT)
+
+# platforms to resolve for with the report resolver, these match the config settings
+# in //tool_bazel
+PLATFORMS = ("linux", "macos")
+
+# platform tags of the wheels to use for each platform
+PLATFORM_TAGS = {
+    "linux": ("manylinux2014_x86_64", "manylinux2010_x86_64", "manylinux1_x86_64"),
+    "macos": (
+        "macosx_10_15_x86_64",
+        "macosx_10_14_x86_64",
+        "macosx_10_13_x86_64",
+        "macosx_10_12_x86_64",
+        "macosx_10_9_x86_64",
+        "macosx_10_6_intel",
+    ),
+}
+
+# pip evaluates environment markers for the host, even when resolving for another
+# --platform, so we run it with the marker environment of the target platform
+PLATFORM_MARKER_ENVIRONMENTS = {
+    "linux": {"sys_platform": "linux", "platform_system": "Linux", "os_name": "posix"},
+    "macos": {"sys_platform": "darwin", "platform_system": "Darwin", "os_name": "posix"},
+}
+
+PIP_MAIN_WITH_MARKER_ENVIRONMENT = """
+import sys
+from pip._vendor.packaging import markers
+environment = markers.default_environment()
+environment.update({environment!r})
+markers.default_environment = lambda: dict(environment)
+from pip._internal.cli.main import main
+sys.exit(main())
 """
 
+# files that are usually not needed at runtime, used when a prune policy has no defaults
+DEFAULT_PRUNE_PATTERNS = (
+    "**/tests/**",
+    "**/doc/**",
+    "**/docs/**",
+    "**/*.pyi",
+    "**/*.c",
+    "**/*.h",
+)
+
 BLACKLIST = {"setuptools", "typing"}  # causes issues in python versions > 3.4
 
 SUPPORTED_PYTHON3_VERSIONS = ["py3", "py2.py3", "py34", "py35", "py36", "py37", "py38"]
 CPYTHON_VERSIONS = ("cp34", "cp35", "cp36", "cp37", "cp38")
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60  # seconds
+DOWNLOAD_ATTEMPTS = 5
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_RETRY_DELAY = 2  # seconds, multiplied by the attempt number
+
+# errors after which a download is worth resuming, note that URLError,
+# timeouts and connection resets are all OSErrors
+RETRYABLE_DOWNLOAD_ERRORS = (OSError, http.client.HTTPException)
+RETRYABLE_HTTP_STATUSES = {408, 429}
+
 
 class PyBazelRuleGeneratorException(Exception):
     pass
@@ -117,14 +313,187 @@ def _space(x: int):
     return " " * x
 
 
-def _download(url: str, dest: str) -> None:
-    logger.info("Downloading %s", url)
-    urllib.request.urlretrieve(url, dest)
+def _templates_digest() -> str:
+    """Hash of the templates of the output file, part of its fingerprint
 
+    A change to a template changes the fingerprint by itself; a change to
+    how the rest of the output is rendered still needs a new __version__.
+    """
+    templates = (
+        HEADER,
+        BUILD_FILE_TMPL,
+        SITE_PACKAGES_RULE,
+        SITE_PACKAGES_LIBRARY_TMPL,
+        SITE_PACKAGES_TMPL,
+        ARCHIVE_TMPL,
+        FOOTER,
+        PRECOMPILE_CMD,
+    )
+    return hashlib.sha256("\0".join(templates).encode("utf-8")).hexdigest()
+
+
+class _IncompleteDownload(http.client.HTTPException):
+    pass
 
-def _calc_sha256sum(filepath: str) -> str:
+
+def _download(
+    url: str,
+    dest: str,
+    digest: typing.Optional[typing.Tuple[str, str]] = None,
+    cache: typing.Optional[http_cache.HttpCache] = None,
+) -> None:
+    """Download `url` to `dest`, resuming and verifying.
+
+    The body is written to `dest + ".part"` and only renamed to `dest` once
+    it is complete and verified, so an interrupted download never leaves a
+    truncated wheel behind. Retries (and later runs) resume the partial file
+    with a HTTP Range request. `digest` is an optional (algorithm, hexdigest)
+    pair, as found in the fragment of index links; without it (or with an
+    algorithm hashlib does not have) we check that the file is a readable zip
+    archive.
+
+    Nothing is downloaded if `dest` already exists and is valid. With a
+    `cache`, a cached body is used if it matches `digest` or the server says
+    it was not modified, and downloaded bodies are added to the cache.
+    """
+    if digest and digest[0].lower() not in hashlib.algorithms_available:
+        logger.warning(
+            "Cannot verify %s with unknown hash algorithm %s, only checking it is a zip",
+            url,
+            digest[0],
+        )
+        digest = None
+
+    if os.path.exists(dest):
+        if _is_valid_download(dest, digest):
+            logger.info("Already downloaded %s", dest)
+            return
+        logger.warning("Removing invalid download %s", dest)
+        os.remove(dest)
+
+    response = None  # the changed body, if revalidation already requested it
+    if cache is not None:
+        entry = cache.lookup(url)
+        if entry is not None:
+            outcome = None
+            if digest and _is_valid_download(entry.path, digest):
+                outcome = http_cache.HIT
+            else:
+                not_modified, response = cache.revalidate(url, entry, DOWNLOAD_TIMEOUT)
+                if not_modified and _is_valid_download(entry.path, digest):
+                    outcome = http_cache.NOT_MODIFIED
+            if outcome:
+                logger.info("Using cached %s", url)
+                shutil.copyfile(entry.path, dest)
+                cache.record(outcome)
+                return
+        cache.record(http_cache.MISS)
+
+    part_path = dest + ".part"
+    headers = None
+    for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+        try:
+            if response is not None:
+                changed, response = response, None
+                headers = _read_response(changed, part_path, 0)
+            else:
+                headers = _download_part(url, part_path) or headers
+        except RETRYABLE_DOWNLOAD_ERRORS as e:
+            if (
+                isinstance(e, urllib.error.HTTPError)
+                and e.code < 500
+                and e.code not in RETRYABLE_HTTP_STATUSES
+            ):
+                raise PyBazelRuleGeneratorException(
+                    "Could not download {}: {}".format(url, e)
+                )
+            logger.warning("Download attempt %s of %s failed: %s", attempt, url, e)
+        else:
+            if _is_valid_download(part_path, digest):
+                os.replace(part_path, dest)
+                if cache is not None:
+                    cache.store(url, dest, headers)
+                return
+            logger.warning("Verification of %s failed, restarting download", url)
+            os.remove(part_path)
+        time.sleep(DOWNLOAD_RETRY_DELAY * attempt)
+    raise PyBazelRuleGeneratorException(
+        "Could not download {} after {} attempts".format(url, DOWNLOAD_ATTEMPTS)
+    )
+
+
+def _download_part(url: str, part_path: str) -> typing.Optional[http.client.HTTPMessage]:
+    """Fetch (the rest of) `url` into `part_path` and return the response headers.
+
+    Raises _IncompleteDownload if the connection ended before the full body
+    was received, the partial file is kept for the next attempt.
+    """
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    request = urllib.request.Request(url)
+    if offset:
+        logger.info("Resuming %s from byte %s", url, offset)
+        request.add_header("Range", "bytes={}-".format(offset))
+    else:
+        logger.info("Downloading %s", url)
+
+    try:
+        response = urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        if offset and e.code == 416:
+            # the range starts at (or past) the end, the partial file is
+            # already complete or bogus, verification will tell
+            return None
+        raise
+    if offset and response.status != 206:
+        # server ignored the range, start over
+        offset = 0
+    return _read_response(response, part_path, offset)
+
+
+def _read_response(
+    response: http.client.HTTPResponse, part_path: str, offset: int
+) -> http.client.HTTPMessage:
+    """Write the body of `response` to `part_path` from `offset` on and close it.
+
+    Raises _IncompleteDownload like _download_part.
+    """
+    with response:
+        expected_size = None
+        content_length = response.getheader("Content-Length")
+        if content_length is not None:
+            expected_size = offset + int(content_length)
+
+        with open(part_path, "ab" if offset else "wb") as fd:
+            while True:
+                try:
+                    buf = response.read(DOWNLOAD_CHUNK_SIZE)
+                except http.client.IncompleteRead as e:
+                    fd.write(e.partial)
+                    raise _IncompleteDownload(
+                        "connection closed after {} bytes".format(fd.tell())
+                    )
+                if not buf:
+                    break
+                fd.write(buf)
+            received = fd.tell()
+
+    if expected_size is not None and received != expected_size:
+        raise _IncompleteDownload(
+            "got {} of {} bytes".format(received, expected_size)
+        )
+    return response.headers
+
+
+def _is_valid_download(filepath: str, digest: typing.Optional[typing.Tuple[str, str]]) -> bool:
+    if digest:
+        algorithm, expected = digest
+        return _calc_digest(filepath, algorithm) == expected.lower()
+    return zipfile.is_zipfile(filepath)
+
+
+def _calc_digest(filepath: str, algorithm: str) -> str:
     with open(filepath, "rb") as fd:
-        digest = hashlib.sha256()
+        digest = hashlib.new(algorithm)
         while True:
             buf = fd.read(4096)
             if not buf:
@@ -133,6 +502,115 @@ def _calc_sha256sum(filepath: str) -> str:
         return digest.hexdigest()
 
 
+def _calc_sha256sum(filepath: str) -> str:
+    return _calc_digest(filepath, "sha256")
+
+
+def _add_to_repository_cache(cache_dir: str, filepath: str, sha256: str, canonical_id: str) -> bool:
+    """Put the file at `filepath` into the Bazel repository cache at `cache_dir`
+
+    Returns whether the file was copied, files that are already in the cache
+    only get the marker for `canonical_id`.
+    """
+    entry_dir = os.path.join(cache_dir, REPOSITORY_CACHE_DIR, sha256)
+    os.makedirs(entry_dir, exist_ok=True)
+    entry = os.path.join(entry_dir, REPOSITORY_CACHE_FILE)
+    copied = False
+    if not os.path.exists(entry):
+        # Bazel may be reading the cache
+        atomic_copy(filepath, entry)
+        copied = True
+    id_digest = hashlib.sha256(canonical_id.encode("utf-8")).hexdigest()
+    pathlib.Path(entry_dir, REPOSITORY_CACHE_ID_PREFIX + id_digest).touch()
+    return copied
+
+
+def _wheel_weight(filepath: str) -> typing.Tuple[int, int, int]:
+    """Number of files, compressed and uncompressed size of the wheel at `filepath`
+
+    This only reads the zip's central directory, nothing is extracted.
+    """
+    files = compressed = uncompressed = 0
+    with zipfile.ZipFile(filepath) as whl:
+        for info in whl.infolist():
+            if not info.filename.endswith("/"):
+                files += 1
+                compressed += info.compress_size
+                uncompressed += info.file_size
+    return files, compressed, uncompressed
+
+
+def requirements_files(requirements_path: str) -> typing.List[str]:
+    """Return `requirements_path` and the files it includes, in include order."""
+    paths = []
+    pending = [os.path.abspath(requirements_path)]
+    while pending:
+        path = pending.pop(0)
+        if path in paths:
+            continue
+        paths.append(path)
+        with open(path, "rt") as f:
+            for line in f:
+                match = NESTED_REQUIREMENTS_RE.search(line)
+                if match:
+                    pending.append(
+                        os.path.join(os.path.dirname(path), match.group("path"))
+                    )
+    return paths
+
+
+def _requirement_lines(requirements_path: str) -> typing.Iterator[str]:
+    """Logical lines of a requirements file, the way pip reads them
+
+    Lines continued with a trailing backslash (like the --hash options of
+    pip-compile --generate-hashes) are joined, comments are only comments at
+    the start of a line or after whitespace, so URL fragments like #sha256=
+    are kept.
+    """
+    with open(requirements_path, "rt") as f:
+        logical = ""
+        for line in f:
+            line = line.rstrip("\n")
+            if line.endswith("\\"):
+                logical += line[:-1] + " "
+                continue
+            logical = REQUIREMENTS_COMMENT_RE.sub("", logical + line).strip()
+            if logical:
+                yield " ".join(logical.split())
+            logical = ""
+        logical = REQUIREMENTS_COMMENT_RE.sub("", logical).strip()
+        if logical:
+            yield " ".join(logical.split())
+
+
+def _shard_requirements(requirements_path: str, index: int, count: int, dest: str) -> int:
+    """Write shard `index` (1-based) of `count` of the requirements file to `dest`
+
+    Requirements, with their own options (--hash), are dealt out round robin.
+    Global options and nested requirement files are kept in every shard, with
+    relative paths made absolute as `dest` is elsewhere. Returns the number of
+    requirements in the shard.
+    """
+    base_dir = os.path.dirname(os.path.abspath(requirements_path))
+    lines = []
+    requirements = 0
+    position = 0
+    for line in _requirement_lines(requirements_path):
+        if line.startswith("-") and not EDITABLE_REQUIREMENT_RE.match(line):
+            match = NESTED_REQUIREMENTS_RE.match(line)
+            if match:
+                line = "{} {}".format(match.group(1), os.path.join(base_dir, match.group("path")))
+            lines.append(line)
+            continue
+        if position % count == index - 1:
+            lines.append(line)
+            requirements += 1
+        position += 1
+    with open(dest, "wt") as f:
+        f.write("\n".join(lines) + "\n")
+    return requirements
+
+
 def _check_compatibility(filename: str, desired_pyver: str) -> bool:
     match = WHEEL_FILE_RE.search(filename)
 
@@ -167,58 +645,314 @@ def _check_compatibility(filename: str, desired_pyver: str) -> bool:
     return False
 
 
+def _glob_to_re(pattern: str) -> typing.Pattern:
+    """Translate a Bazel glob pattern into a regular expression.
+
+    As in Bazel, `**` matches any number of path segments (including none)
+    and `*` and `?` never match a `/`.
+    """
+    parts = []
+    segments = pattern.split("/")
+    for i, segment in enumerate(segments):
+        is_last = i == len(segments) - 1
+        if segment == "**":
+            parts.append(".*" if is_last else "(?:[^/]+/)*")
+        else:
+            regex = re.escape(segment).replace(r"\*", "[^/]*").replace(r"\?", "[^/]")
+            parts.append(regex if is_last else regex + "/")
+    return re.compile("^{}$".format("".join(parts)))
+
+
+class PrunePolicy:
+    """Glob patterns of files to leave out of each library.
+
+    The policy is read from a JSON file like:
+
+        {
+            "default": ["**/tests/**", "**/*.pyi"],
+            "packages": {
+                "numpy": [],
+                "pandas": ["**/tests/**", "**/*.pyx"]
+            }
+        }
+
+    where the patterns of a package replace the defaults for that package. If
+    "default" is left out, DEFAULT_PRUNE_PATTERNS is used.
+    """
+
+    def __init__(self, default=DEFAULT_PRUNE_PATTERNS, packages=None):
+        self.default = tuple(default)
+        self.packages = {
+            name.replace("-", "_").lower(): tuple(patterns)
+            for name, patterns in (packages or {}).items()
+        }
+
+    @classmethod
+    def from_file(cls, path: str) -> "PrunePolicy":
+        with open(path, "rt") as f:
+            try:
+                config = json.load(f)
+            except ValueError as e:
+                raise PyBazelRuleGeneratorException(
+                    "Invalid prune policy {}: {}".format(path, e)
+                )
+        unknown_keys = set(config) - {"default", "packages"}
+        if unknown_keys:
+            raise PyBazelRuleGeneratorException(
+                "Invalid prune policy {}, unknown keys: {}".format(path, sorted(unknown_keys))
+            )
+        return cls(config.get("default", DEFAULT_PRUNE_PATTERNS), config.get("packages"))
+
+    def to_dict(self) -> dict:
+        return {
+            "default": list(self.default),
+            "packages": {name: list(patterns) for name, patterns in self.packages.items()},
+        }
+
+    def patterns(self, name: str) -> typing.Tuple[str, ...]:
+        """Patterns to prune for the dependency with (normalized) `name`."""
+        return self.packages.get(name, self.default)
+
+    def pruned(self, name: str, filenames: typing.Iterable[str]) -> typing.List[str]:
+        """Return the filenames that the patterns for `name` leave out."""
+        regexes = [_glob_to_re(pattern) for pattern in self.patterns(name)]
+        return [f for f in filenames if any(r.match(f) for r in regexes)]
+
+
+def _render_excludes(prune_patterns: typing.Sequence[str]) -> typing.Tuple[str, str]:
+    """Render the prune patterns as additions to the srcs and data globs"""
+    if not prune_patterns:
+        return "", ""
+    quoted = [_space(8) + '"{}"'.format(pattern) for pattern in prune_patterns]
+    srcs_exclude = ", exclude=[\n{},\n{}]".format(",\n".join(quoted), _space(4))
+    data_exclude = ",\n{}".format(",\n".join(quoted))
+    return srcs_exclude, data_exclude
+
+
+def _render_build_file(constant: str, prune_patterns: typing.Sequence[str]) -> str:
+    srcs_exclude, data_exclude = _render_excludes(prune_patterns)
+    return BUILD_FILE_TMPL.format(
+        constant=constant, srcs_exclude=srcs_exclude, data_exclude=data_exclude
+    )
+
+
+def _entries(filenames: typing.Iterable[str], prefix: str) -> typing.Tuple[set, set]:
+    """Return the files and directories directly inside `prefix`"""
+    files, dirs = set(), set()
+    for filename in filenames:
+        if not filename.startswith(prefix):
+            continue
+        top, sep, rest = filename[len(prefix):].partition("/")
+        if sep:
+            dirs.add(prefix + top)
+        elif top:
+            files.add(prefix + top)
+    return files, dirs
+
+
+def _split_shared_dirs(
+    filenames_by_name: typing.Dict[str, typing.List[str]]
+) -> typing.Dict[str, typing.Tuple[set, set]]:
+    """Return the files and directories that make up each dependency in a shared tree.
+
+    Directories that several dependencies put files into (namespace packages
+    like `google`) are split up into their entries until no directory is
+    shared, so that each library only gets its own files.
+    """
+    entries = {name: _entries(filenames, "") for name, filenames in filenames_by_name.items()}
+    while True:
+        owners = collections.Counter(d for _, dirs in entries.values() for d in dirs)
+        shared = {d for d, count in owners.items() if count > 1}
+        if not shared:
+            return entries
+        for name, (files, dirs) in entries.items():
+            for shared_dir in dirs & shared:
+                dirs.remove(shared_dir)
+                sub_files, sub_dirs = _entries(filenames_by_name[name], shared_dir + "/")
+                files |= sub_files
+                dirs |= sub_dirs
+
+
+class ResolvedDistribution:
+    """Struct for a distribution in a pip installation report."""
+
+    __slots__ = ("name", "version", "filename", "url", "digest", "requires", "extras")
+
+    def __init__(self, name, version, filename, url, digest, requires, extras=None):
+        self.name = name
+        self.version = version
+        self.filename = filename
+        self.url = url
+        self.digest = digest  # (algorithm, hexdigest) or None
+        self.requires = requires  # names of the requirements for the environment
+        self.extras = extras or {}  # names of the additional requirements by extra
+
+
+def _parse_pip_report(
+    report: dict, environment: typing.Optional[dict] = None
+) -> typing.Dict[str, ResolvedDistribution]:
+    """Get the resolved distributions from a pip installation report
+
+    Requirements are evaluated for the marker environment of the interpreter
+    that ran pip, which pip records in the report, updated with the marker
+    `environment` of the target platform. Markers that neither sets are
+    evaluated for this interpreter.
+
+    See https://pip.pypa.io/en/stable/reference/installation-report/
+    """
+    marker_environment = dict(report.get("environment") or {})
+    marker_environment.update(environment or {})
+    marker_environment["extra"] = ""
+    distributions = {}
+    for item in report["install"]:
+        download_info = item["download_info"]
+        url = download_info["url"]
+        filename = urllib.parse.unquote(url.rsplit("/", 1)[-1])
+        match = WHEEL_FILE_RE.search(filename)
+        if not filename.endswith(".whl") or not match:
+            raise PyBazelRuleGeneratorException(
+                "{} has no wheel ({}), use the {} resolver to build it".format(
+                    item["metadata"]["name"], url, RESOLVER_PIP_WHEEL
+                )
+            )
+
+        digest = None
+        archive_info = download_info.get("archive_info", {})
+        hashes = archive_info.get("hashes")
+        if hashes:
+            algorithm = "sha256" if "sha256" in hashes else sorted(hashes)[0]
+            digest = (algorithm, hashes[algorithm])
+        elif archive_info.get("hash"):
+            algorithm, _, value = archive_info["hash"].partition("=")
+            digest = (algorithm, value)
+
+        requires = set()
+        extras = {}
+        provided_extras = item["metadata"].get("provides_extra", [])
+        for specification in item["metadata"].get("requires_dist", []):
+            requirement = pkg_resources.Requirement.parse(specification)
+            requirement_name = _normalize_name(requirement.project_name)
+            if requirement.marker is None or requirement.marker.evaluate(marker_environment):
+                requires.add(requirement_name)
+                continue
+            for extra in provided_extras:
+                if requirement.marker.evaluate(dict(marker_environment, extra=extra)):
+                    extras.setdefault(extra, set()).add(requirement_name)
+
+        name = _normalize_name(item["metadata"]["name"])
+        distributions[name] = ResolvedDistribution(
+            name=name,
+            version=match.group("ver"),
+            filename=filename,
+            url=url,
+            digest=digest,
+            requires=requires,
+            extras=extras,
+        )
+    return distributions
+
+
 class WheelInfo:
-    """Struct for information on a wheel."""
+    """Struct for information on a wheel.
+
+    Everything derived from the filename is computed once up front, these are
+    read over and over again while rendering and we may have many thousands
+    of wheels.
+    """
 
-    def __init__(self, filepath, url, name, version):
+    __slots__ = (
+        "filepath",
+        "url",
+        "name",
+        "version",
+        "sha256sum",
+        "filename",
+        "platform",
+        "archive_name",
+        "lib_path",
+        "_namelist",
+    )
+
+    def __init__(self, filepath, url, name, version, sha256sum=None, namelist=None):
         self.filepath = filepath
         self.url = url
-        self.name = name.lower()
-        self.version = version
+        self.name = sys.intern(name.lower())
+        self.version = sys.intern(version)
 
-        self.sha256sum = _calc_sha256sum(filepath)
+        self.sha256sum = sha256sum or _calc_sha256sum(filepath)
         self.filename = os.path.basename(filepath)
+        self.platform = sys.intern(_wheel_platform(self.filename))
+        self.archive_name = _archive_name(self.name, self.version, self.platform)
+        self.lib_path = "@{}//:pkg".format(self.archive_name)
+        self._namelist = namelist
+
+    def namelist(self) -> typing.List[str]:
+        """The files in the wheel, read from `filepath` unless known already"""
+        if self._namelist is None:
+            with zipfile.ZipFile(self.filepath) as whl:
+                self._namelist = whl.namelist()
+        return self._namelist
+
+    def to_dict(self, namelist: bool = False) -> dict:
+        data = {
+            "filepath": self.filepath,
+            "url": self.url,
+            "name": self.name,
+            "version": self.version,
+            "sha256": self.sha256sum,
+        }
+        if namelist:
+            # the merging machine does not have the wheel at `filepath`
+            data["namelist"] = self.namelist()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "WheelInfo":
+        return cls(
+            data["filepath"],
+            data["url"],
+            data["name"],
+            data["version"],
+            data["sha256"],
+            data.get("namelist"),
+        )
 
     def __repr__(self):
         return "<{} ({})>".format(self.filename, self.platform)
 
-    @property
-    def platform(self) -> str:
-        if "linux" in self.filename:
-            return "linux"
-        elif "macos" in self.filename:
-            return "macos"
-        return "purelib"
-
     def __eq__(self, other):
         return isinstance(other, WheelInfo) and (self.filename == other.filename)
 
     def __hash__(self):
         return hash(self.filename)
 
-    @property
-    def archive_name(self) -> str:
-        """Name of the archive
 
-        Example: 'pypi__futures_3_1_1'
+def _wheel_platform(filename: str) -> str:
+    if "linux" in filename:
+        return "linux"
+    elif "macos" in filename:
+        return "macos"
+    return "purelib"
 
-        This includes the version so that Bazel graph shows it.
 
-        The naming convention matches:
-            https://github.com/bazelbuild/rules_python#canonical-whl_library-naming
-        """
-        version_label = self.version.replace(".", "_")
-        if self.platform != "purelib":
-            return "pypi__{}_{}__{}".format(self.name, version_label, self.platform)
-        return "pypi__{}_{}".format(self.name, version_label)
+def _archive_name(name: str, version: str, platform: str) -> str:
+    """Name of the archive
 
-    @property
-    def lib_path(self) -> str:
-        """Path of the lib inside the archive
+    Example: 'pypi__futures_3_1_1'
 
-        Example: '@pypi__futures_3_1_1//:pkg
-        """
-        return "@{}//:pkg".format(self.archive_name)
+    This includes the version so that Bazel graph shows it.
+
+    The naming convention matches:
+        https://github.com/bazelbuild/rules_python#canonical-whl_library-naming
+    """
+    version_label = version.replace(".", "_")
+    if platform != "purelib":
+        return "pypi__{}_{}__{}".format(name, version_label, platform)
+    return "pypi__{}_{}".format(name, version_label)
+
+
+def _normalize_name(name: str) -> str:
+    return sys.intern(name.replace("-", "_").lower())
 
 
 class DependencyInfo:
@@ -226,21 +960,44 @@ class DependencyInfo:
 
     A dependency can have 1 or 2 wheels. If it's a "purelib"
     dependency it should have 1 wheel and if it's a "platform"
-    dependency it should have 2 wheels, one for linux one for macos
+    dependency it should have 2 wheels, one for linux one for macos.
+    Wheels are kept sorted by platform.
     """
 
+    __slots__ = ("name", "dependencies", "platform_dependencies", "extras", "wheels", "modules")
+
     def __init__(self, name, deps, extras):
-        self.name = name.replace("-", "_").lower()
-        self._deps = deps  # subdependencies
-        self._extras = (
-            extras
-        )  # TODO(c4urself): implement, don't care about it right now
+        self.name = _normalize_name(name)
+        # subdependencies, names are interned as they repeat across the graph
+        self.dependencies = sorted({_normalize_name(dep) for dep in deps})
+        # additional subdependencies on some platforms only, by platform
+        self.platform_dependencies = {}  # type: typing.Dict[str, typing.List[str]]
+        # additional subdependencies of each extra, see extra_targets
+        self.extras = {
+            extra: sorted({_normalize_name(dep) for dep in extra_deps} - {self.name})
+            for extra, extra_deps in (extras or {}).items()
+        }  # type: typing.Dict[str, typing.List[str]]
 
         self.wheels = []
+        self.modules = []  # importable (top level) modules, see Wheel.top_level_modules
 
-    @property
-    def dependencies(self):
-        return sorted([dep.replace("-", "_").lower() for dep in self._deps])
+    def extra_targets(
+        self, resolved: typing.Set[str]
+    ) -> typing.List[typing.Tuple[str, typing.List[str]]]:
+        """Names and subdependencies of the libraries for the extras
+
+        Only extras whose subdependencies are all in `resolved` get a library,
+        pip resolves them only for extras that some requirement asked for.
+
+        Example: [('requests__socks', ['pysocks'])]
+        """
+        targets = []
+        for extra in sorted(self.extras):
+            extra_deps = self.extras[extra]
+            if all(dep in resolved for dep in extra_deps):
+                name = "{}__{}".format(self.name, re.sub(r"[-_.]+", "_", extra).lower())
+                targets.append((name, extra_deps))
+        return targets
 
     def verify(self, platforms: typing.Set) -> bool:
         """Verify that this dependency has the necessary wheels."""
@@ -275,6 +1032,27 @@ class DependencyInfo:
                 # purelib variants, let's prefer the purelib wheel
                 self.wheels = []
         self.wheels.append(wheel)
+        if len(self.wheels) > 1:
+            self.wheels.sort(key=operator.attrgetter("platform"))
+
+    def to_dict(self, namelists: bool = False) -> dict:
+        return {
+            "name": self.name,
+            "dependencies": self.dependencies,
+            "platform_dependencies": self.platform_dependencies,
+            "extras": self.extras,
+            "modules": self.modules,
+            "wheels": [wheel.to_dict(namelists) for wheel in self.wheels],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DependencyInfo":
+        dependency = cls(data["name"], data["dependencies"], data["extras"])
+        dependency.platform_dependencies = data["platform_dependencies"]
+        dependency.modules = data["modules"]
+        for wheel in data["wheels"]:
+            dependency.add_wheel(WheelInfo.from_dict(wheel))
+        return dependency
 
     def __eq__(self, other):
         return isinstance(other, DependencyInfo) and (self.name == other.name)
@@ -286,6 +1064,38 @@ class DependencyInfo:
         return self.name
 
 
+class GenerationResult:
+    """Struct for what a run resolved and rendered."""
+
+    __slots__ = ("dependencies", "text", "fingerprint")
+
+    def __init__(self, dependencies, text, fingerprint):
+        self.dependencies = dependencies  # type: typing.List[DependencyInfo]  # sorted by name
+        self.text = text  # the rendered bzl file, None for a shard
+        self.fingerprint = fingerprint
+
+    @property
+    def wheels(self) -> typing.List[WheelInfo]:
+        return [wheel for dependency in self.dependencies for wheel in dependency.wheels]
+
+    @property
+    def hashes(self) -> typing.Dict[str, str]:
+        """sha256 of each wheel by filename"""
+        return {wheel.filename: wheel.sha256sum for wheel in self.wheels}
+
+    def dependency(self, name: str) -> DependencyInfo:
+        normalized = _normalize_name(name)
+        for dependency in self.dependencies:
+            if dependency.name == normalized:
+                return dependency
+        raise KeyError(name)
+
+
+# called with the stage ("resolve", "wheels", "render"), the number of steps of
+# the stage done so far and the total number of steps
+ProgressCallback = typing.Callable[[str, int, int], None]
+
+
 class RequirementsToBazelLibGenerator:
     """Generator for creating Bazel rules from a requirements-file"""
 
@@ -296,6 +1106,22 @@ class RequirementsToBazelLibGenerator:
         output_file: str,
         bzl_path: str,
         desired_python: str,
+        precompile: bool = False,
+        prune_policy: typing.Optional[PrunePolicy] = None,
+        prune_report: typing.Optional[str] = None,
+        layout: str = LAYOUT_ARCHIVES,
+        module_index: typing.Optional[str] = None,
+        resolver: str = RESOLVER_PIP_WHEEL,
+        platforms: typing.Sequence[str] = PLATFORMS,
+        repository_cache: typing.Optional[str] = None,
+        cache_dir: typing.Optional[str] = None,
+        mirror_url: typing.Optional[str] = None,
+        mirror_dir: typing.Optional[str] = None,
+        weight_report: typing.Optional[str] = None,
+        wheel_dir_budget: typing.Optional[int] = None,
+        shard: typing.Optional[typing.Tuple[int, int]] = None,
+        partial_output: typing.Optional[str] = None,
+        progress: typing.Optional[ProgressCallback] = None,
     ):
         self.requirements_path = requirements_path
         self.wheel_dir = wheel_dir
@@ -303,17 +1129,211 @@ class RequirementsToBazelLibGenerator:
         self.bzl_path = bzl_path
         self.desired_python = desired_python
         self.desired_python_full = "python{}".format(".".join(self.desired_python))
+        self.precompile = precompile
+        self.prune_policy = prune_policy
+        self.prune_report = prune_report
+        if layout not in LAYOUTS:
+            raise PyBazelRuleGeneratorException("Unknown layout: {}".format(layout))
+        self.layout = layout
+        self.module_index = module_index
+        if resolver not in RESOLVERS:
+            raise PyBazelRuleGeneratorException("Unknown resolver: {}".format(resolver))
+        self.resolver = resolver
+        unknown_platforms = set(platforms) - set(PLATFORMS)
+        if unknown_platforms:
+            raise PyBazelRuleGeneratorException(
+                "Unknown platform(s): {}".format(sorted(unknown_platforms))
+            )
+        self.platforms = tuple(sorted(platforms))
+        self.repository_cache = repository_cache
+        self.http_cache = http_cache.HttpCache(cache_dir) if cache_dir else None
+        self.mirror_url = mirror_url.rstrip("/") if mirror_url else None
+        self.mirror_dir = mirror_dir
+        self.weight_report = weight_report
+        self.wheel_dir_budget = wheel_dir_budget  # bytes of unused wheels to keep
+        if shard is not None:
+            index, count = shard
+            if not 1 <= index <= count:
+                raise PyBazelRuleGeneratorException(
+                    "Invalid shard {}/{}".format(index, count)
+                )
+            if output_file:
+                raise PyBazelRuleGeneratorException(
+                    "A shard only has part of the dependencies, write a partial output"
+                    " and merge it with the other shards instead of an output file"
+                )
+        self.shard = shard
+        self.partial_output = partial_output
+        # what pip resolves, only part of the requirements file for a shard
+        self._pip_requirements_path = requirements_path
+        self.progress = progress
+        self._wheel_digests = {}  # type: typing.Dict[str, typing.Tuple[str, str]]
+
+    def fingerprint(self) -> str:
+        """Hash of all inputs that determine the output file.
+
+        This covers the requirements file (and any files it includes), the
+        python version, the bazel path, the generator version and its output
+        templates and the options that change the output; it does not
+        cover what the package index serves, so it only changes when we did.
+        """
+        digest = hashlib.sha256()
+        for path in requirements_files(self.requirements_path):
+            digest.update(os.path.basename(path).encode("utf-8"))
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        digest.update(json.dumps(self._fingerprint_options(), sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _fingerprint_options(self) -> dict:
+        options = {
+            "generator": __version__,
+            "templates": _templates_digest(),
+            "python": self.desired_python,
+            "bzl_path": self.bzl_path,
+        }
+        if self.precompile:
+            options["precompile"] = True
+        if self.prune_policy:
+            options["prune"] = self.prune_policy.to_dict()
+        if self.layout != LAYOUT_ARCHIVES:
+            options["layout"] = self.layout
+        if self.resolver != RESOLVER_PIP_WHEEL:
+            options["resolver"] = self.resolver
+            options["platforms"] = list(self.platforms)
+        if self.mirror_url:
+            options["mirror_url"] = self.mirror_url
+        return options
+
+    def check(self) -> bool:
+        """Check that the output file was generated from the current inputs.
+
+        This needs neither pip nor the network, so it is cheap enough to run
+        on every CI build.
+        """
+        try:
+            with open(self.output_file, "rt") as f:
+                match = FINGERPRINT_RE.search(f.read())
+        except FileNotFoundError:
+            logger.error("Output file %s does not exist", self.output_file)
+            return False
+        if not match:
+            logger.error("Output file %s has no fingerprint", self.output_file)
+            return False
+        if match.group("fingerprint") != self.fingerprint():
+            logger.error(
+                "Output file %s is stale, regenerate it from %s",
+                self.output_file,
+                self.requirements_path,
+            )
+            return False
+        return True
 
-    def run(self) -> None:
-        """Main entrypoint into builder."""
+    def run(self) -> GenerationResult:
+        """Main entrypoint into builder.
+
+        Writes the output file (if there is one) and the reports, and returns
+        the resolved dependencies and the rendered text.
+        """
         logger.info("Validating")
         self._validate()
+        deps = self._resolve()
+        text = None
+        if self.shard is None:
+            text = self.render(deps)
+            self._report_progress("render", 1, 1)
+        if self.partial_output:
+            logger.info("\nWriting partial output\n")
+            self._write_partial_output(deps)
+        if self.output_file:
+            logger.info("\nGenerating output file\n")
+            self._write_output_file(text)
+        if self.prune_policy and self.prune_report:
+            logger.info("\nWriting prune report\n")
+            self._write_prune_report(deps)
+        if self.module_index:
+            logger.info("\nWriting module index\n")
+            self._write_module_index(deps)
+        if self.weight_report:
+            logger.info("\nWriting weight report\n")
+            self._write_weight_report(deps)
+        if self.mirror_dir:
+            logger.info("\nPublishing wheels to mirror\n")
+            self._publish_to_mirror(deps)
+        if self.repository_cache:
+            logger.info("\nSeeding repository cache\n")
+            self._seed_repository_cache(deps)
+        if self.wheel_dir_budget is not None:
+            logger.info("\nCollecting unused wheels\n")
+            self._collect_wheels(deps)
+        if self.http_cache:
+            logger.info("HTTP cache: %s", self.http_cache.summary())
+        return GenerationResult(
+            sorted(deps, key=operator.attrgetter("name")), text, self.fingerprint()
+        )
+
+    def _resolve(self) -> typing.Set[DependencyInfo]:
+        if self.shard is None:
+            return self._resolve_requirements()
+        index, count = self.shard
+        with tempfile.TemporaryDirectory() as tmp:
+            self._pip_requirements_path = os.path.join(tmp, "requirements.txt")
+            requirements = _shard_requirements(
+                self.requirements_path, index, count, self._pip_requirements_path
+            )
+            logger.info("Shard %s/%s has %s requirements", index, count, requirements)
+            try:
+                return self._resolve_requirements()
+            finally:
+                self._pip_requirements_path = self.requirements_path
+
+    def _resolve_requirements(self) -> typing.Set[DependencyInfo]:
+        if self.resolver == RESOLVER_PIP_REPORT:
+            logger.info("Resolving for platforms %s via pip", ", ".join(self.platforms))
+            return self._resolve_platforms()
         logger.info("Getting wheel links via pip")
-        wheel_links = self._get_wheel_links()
+        wheel_links, wheel_filenames = self._get_wheel_links()
+        self._report_progress("resolve", 1, 1)
         logger.info("\nParsing dependencies from wheels\n")
-        deps = self._parse_wheel_dependencies(wheel_links)
-        logger.info("\nGenerating output file\n")
-        self._gen_output_file(deps)
+        return self._parse_wheel_dependencies(wheel_links, wheel_filenames)
+
+    def partial_options(self) -> dict:
+        """The options that determine the output, as keyword arguments
+
+        All shards must have the same ones, merge.py renders the output with
+        them.
+        """
+        return {
+            "bzl_path": self.bzl_path,
+            "desired_python": self.desired_python,
+            "precompile": self.precompile,
+            "prune_policy": self.prune_policy.to_dict() if self.prune_policy else None,
+            "layout": self.layout,
+            "resolver": self.resolver,
+            "platforms": list(self.platforms),
+            "mirror_url": self.mirror_url,
+        }
+
+    def _write_partial_output(self, deps) -> None:
+        """Write the resolved `deps` as JSON, to be merged with the other shards"""
+        partial = {
+            "format": PARTIAL_FORMAT,
+            "fingerprint": self.fingerprint(),
+            "shard": list(self.shard or (1, 1)),
+            "options": self.partial_options(),
+            "dependencies": [
+                # the site-packages BUILD file lists the files of each wheel
+                dependency.to_dict(namelists=self.layout == LAYOUT_SITE_PACKAGES)
+                for dependency in sorted(deps, key=operator.attrgetter("name"))
+            ],
+        }
+        with open(self.partial_output, "wt") as f:
+            json.dump(partial, f, indent=2, sort_keys=True)
+        logger.info("Wrote %s dependencies to %s", len(deps), self.partial_output)
+
+    def _report_progress(self, stage: str, done: int, total: int) -> None:
+        if self.progress is not None:
+            self.progress(stage, done, total)
 
     def _validate(self) -> None:
         with open(self.requirements_path, "rt") as f:
@@ -328,6 +1348,8 @@ class RequirementsToBazelLibGenerator:
                 "Wheel dir parent directory '{}' does not exist".format(whl_path.parent)
             )
 
+        if self.output_file is None:
+            return
         output_path = pathlib.Path(self.output_file)
         if not output_path.parent.exists():
             raise PyBazelRuleGeneratorException(
@@ -336,6 +1358,315 @@ class RequirementsToBazelLibGenerator:
                 )
             )
 
+    def _build_file_constants(self, deps) -> typing.Dict[str, str]:
+        """Names of the build file content constants of `deps`, by dependency name
+
+        Dependencies with the default prune patterns share one constant. Names
+        that only differ in punctuation ("foo.bar", "foo_bar") would get the
+        same identifier, which Starlark rejects, so later ones get a suffix.
+        """
+        constants = {}
+        taken = {BUILD_FILE_CONSTANT}
+        for name in sorted(dependency.name for dependency in deps):
+            if (
+                self.prune_policy is None
+                or self.prune_policy.patterns(name) == self.prune_policy.default
+            ):
+                constants[name] = BUILD_FILE_CONSTANT
+                continue
+            base = "{}_{}".format(BUILD_FILE_CONSTANT, re.sub(r"\W", "_", name).upper())
+            constant, suffix = base, 1
+            while constant in taken:
+                suffix += 1
+                constant = "{}_{}".format(base, suffix)
+            taken.add(constant)
+            constants[name] = constant
+        return constants
+
+    def _build_file_contents(self, constants: typing.Dict[str, str]) -> str:
+        """Render the build file content `constants` used by the archives
+
+        Without a prune policy there is a single shared constant, otherwise
+        there is one more for each dependency that overrides the defaults.
+        """
+        if self.prune_policy is None:
+            return _render_build_file(BUILD_FILE_CONSTANT, ())
+        contents = [_render_build_file(BUILD_FILE_CONSTANT, self.prune_policy.default)]
+        for name, constant in sorted(constants.items()):
+            if constant != BUILD_FILE_CONSTANT:
+                contents.append(_render_build_file(constant, self.prune_policy.patterns(name)))
+        return "".join(contents)
+
+    def _write_module_index(self, deps) -> None:
+        """Write a JSON index of modules to distributions and the dependency graph
+
+        This is the input for rules_pygen.import_audit, which finds unused and
+        missing requirements.
+        """
+        modules = {}
+        for dependency in deps:
+            for module in dependency.modules:
+                modules.setdefault(module, []).append(dependency.name)
+        index = {
+            "modules": {module: sorted(names) for module, names in modules.items()},
+            "dependencies": {dependency.name: dependency.dependencies for dependency in deps},
+        }
+        with open(self.module_index, "wt") as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        logger.info("Wrote index of %s modules to %s", len(modules), self.module_index)
+
+    def _wheel_urls(self, wheel: WheelInfo) -> typing.List[str]:
+        """URLs to fetch `wheel` from, the mirror (if any) first and the origin as fallback"""
+        if self.mirror_url:
+            # local versions ("1.0+cpu") have a "+" that would be read as a space
+            mirror_url = "{}/{}".format(self.mirror_url, urllib.parse.quote(wheel.filename))
+            return [mirror_url, wheel.url]
+        return [wheel.url]
+
+    def _publish_to_mirror(self, deps) -> None:
+        """Copy the wheels of `deps` into the mirror directory
+
+        Wheels already in the mirror are skipped, unless the copy there has a
+        different hash (a truncated or otherwise broken copy).
+        """
+        os.makedirs(self.mirror_dir, exist_ok=True)
+        wheels = [wheel for dependency in deps for wheel in dependency.wheels]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            copied = sum(executor.map(self._publish_wheel, wheels))
+        logger.info(
+            "Published %s of %s wheels to mirror %s", copied, len(wheels), self.mirror_dir
+        )
+
+    def _publish_wheel(self, wheel: WheelInfo) -> bool:
+        dest = os.path.join(self.mirror_dir, wheel.filename)
+        if (
+            os.path.exists(dest)
+            and os.path.getsize(dest) == os.path.getsize(wheel.filepath)
+            and _calc_sha256sum(dest) == wheel.sha256sum
+        ):
+            return False
+        # the mirror may be served already
+        atomic_copy(wheel.filepath, dest, 0o644)
+        return True
+
+    def _collect_wheels(self, deps) -> None:
+        """Remove the least recently used wheels that `deps` don't use from the wheel dir
+
+        Unused wheels (old versions, removed requirements) are kept as long as
+        they fit into the budget, the most recently used first. The wheels that
+        are used get their mtime updated, so it tells when they were last used.
+        Partial downloads left by interrupted runs are removed as well, the
+        downloads of this run are all complete by now.
+        """
+        for filepath in glob.glob(os.path.join(self.wheel_dir, "*.whl.part")):
+            logger.info("Removing partial download %s", filepath)
+            os.remove(filepath)
+
+        used = {wheel.filename for dependency in deps for wheel in dependency.wheels}
+        unused = []
+        for filepath in glob.glob(os.path.join(self.wheel_dir, "*.whl")):
+            if os.path.basename(filepath) in used:
+                os.utime(filepath)
+            else:
+                unused.append((os.path.getmtime(filepath), filepath))
+
+        kept_bytes = removed_bytes = removed = 0
+        for _, filepath in sorted(unused, reverse=True):
+            size = os.path.getsize(filepath)
+            if not removed and kept_bytes + size <= self.wheel_dir_budget:
+                kept_bytes += size
+                continue
+            # once the budget is used up, everything used less recently goes
+            logger.debug("Removing unused wheel %s", filepath)
+            os.remove(filepath)
+            removed += 1
+            removed_bytes += size
+        logger.info(
+            "Removed %s unused wheels (%s bytes), kept %s unused wheels (%s bytes) in %s",
+            removed,
+            removed_bytes,
+            len(unused) - removed,
+            kept_bytes,
+            self.wheel_dir,
+        )
+
+    def _seed_repository_cache(self, deps) -> None:
+        """Put the wheels of `deps` into the Bazel repository cache
+
+        Bazel looks up downloads with a sha256 in its repository cache before
+        going to the network, so seeding it from the wheels we already have
+        saves downloading each of them again on the first fetch.
+        """
+        copied = 0
+        wheels = [wheel for dependency in deps for wheel in dependency.wheels]
+        for wheel in wheels:
+            if _add_to_repository_cache(
+                self.repository_cache, wheel.filepath, wheel.sha256sum, wheel.url
+            ):
+                copied += 1
+        logger.info(
+            "Added %s of %s wheels to repository cache %s",
+            copied,
+            len(wheels),
+            self.repository_cache,
+        )
+
+    def _write_prune_report(self, deps) -> None:
+        """Write a CSV report of the files and bytes the prune policy removes per archive"""
+        total_files = total_bytes = 0
+        with open(self.prune_report, "wt", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                ["archive", "package", "files", "bytes", "files_removed", "bytes_removed"]
+            )
+            for dependency in sorted(deps, key=operator.attrgetter("name")):
+                for wheel in dependency.wheels:
+                    with zipfile.ZipFile(wheel.filepath) as whl:
+                        sizes = {
+                            info.filename: info.file_size
+                            for info in whl.infolist()
+                            if not info.filename.endswith("/")
+                        }
+                    pruned = self.prune_policy.pruned(dependency.name, sizes)
+                    pruned_bytes = sum(sizes[filename] for filename in pruned)
+                    writer.writerow([
+                        wheel.archive_name,
+                        dependency.name,
+                        len(sizes),
+                        sum(sizes.values()),
+                        len(pruned),
+                        pruned_bytes,
+                    ])
+                    total_files += len(pruned)
+                    total_bytes += pruned_bytes
+        logger.info(
+            "Prune policy removes %s files (%s bytes), report written to %s",
+            total_files,
+            total_bytes,
+            self.prune_report,
+        )
+
+    def _write_weight_report(self, deps) -> None:
+        """Write a CSV report of the size of each dependency and its transitive closure
+
+        There is a row per dependency and platform, as platforms have their own
+        wheels and dependencies. Rows are sorted by the uncompressed size of the
+        closure, the biggest (slowest to set up) first.
+        """
+        weights = {}  # type: typing.Dict[str, typing.Dict[str, typing.Tuple[int, int, int]]]
+        for dependency in deps:
+            by_platform = weights.setdefault(dependency.name, {})
+            for wheel in dependency.wheels:
+                weight = _wheel_weight(wheel.filepath)
+                platforms = self.platforms if wheel.platform == "purelib" else [wheel.platform]
+                for platform in platforms:
+                    by_platform[platform] = weight
+
+        rows = []
+        for platform in self.platforms:
+            graph = {
+                dependency.name: (
+                    dependency.dependencies + dependency.platform_dependencies.get(platform, [])
+                )
+                for dependency in deps
+            }
+            for dependency in deps:
+                if platform not in weights[dependency.name]:
+                    continue
+                closure = set()
+                pending = [dependency.name]
+                while pending:
+                    name = pending.pop()
+                    if name not in closure and platform in weights.get(name, {}):
+                        closure.add(name)
+                        pending.extend(graph[name])
+                closure_weights = [weights[name][platform] for name in closure]
+                rows.append(
+                    [dependency.name, platform]
+                    + list(weights[dependency.name][platform])
+                    + [len(closure)]
+                    + [sum(column) for column in zip(*closure_weights)]
+                )
+        rows.sort(key=lambda row: (-row[-1], row[0], row[1]))
+
+        with open(self.weight_report, "wt", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow([
+                "package",
+                "platform",
+                "files",
+                "compressed_bytes",
+                "uncompressed_bytes",
+                "closure_packages",
+                "closure_files",
+                "closure_compressed_bytes",
+                "closure_uncompressed_bytes",
+            ])
+            writer.writerows(rows)
+        if rows:
+            logger.info(
+                "Heaviest dependency is %s on %s with %s bytes installed (%s packages)",
+                rows[0][0],
+                rows[0][1],
+                rows[0][-1],
+                rows[0][5],
+            )
+        logger.info("Weight report written to %s", self.weight_report)
+
+    @property
+    def site_packages_repository(self) -> str:
+        """Name of the repository with all wheels in the site-packages layout
+
+        Example: 'pypi__site_packages__3rdparty_python'
+        """
+        return "pypi__site_packages__{}".format(re.sub(r"\W", "_", self.bzl_path.strip("/")))
+
+    def _site_packages_build_file(self, deps) -> str:
+        """Render the BUILD file of the site-packages repository
+
+        There is a library per dependency with the files of its wheel(s), they
+        all share the repository root as their import path.
+        """
+        filenames_by_name = {}
+        for dependency in deps:
+            filenames = filenames_by_name.setdefault(dependency.name, [])
+            for wheel in dependency.wheels:
+                filenames.extend(wheel.namelist())
+        entries = _split_shared_dirs(filenames_by_name)
+
+        contents = []
+        for dependency in deps:
+            files, dirs = entries[dependency.name]
+            srcs = sorted(f for f in files if f.endswith(".py"))
+            srcs += ["{}/**/*.py".format(d) for d in sorted(dirs)]
+            data = sorted(f for f in files if not f.endswith(".py"))
+            data += ["{}/**".format(d) for d in sorted(dirs)]
+            prune_patterns = ()
+            if self.prune_policy:
+                prune_patterns = self.prune_policy.patterns(dependency.name)
+            srcs_exclude, data_exclude = _render_excludes(prune_patterns)
+            contents.append(
+                SITE_PACKAGES_LIBRARY_TMPL.format(
+                    name=dependency.name,
+                    srcs=json.dumps(srcs),
+                    srcs_exclude=srcs_exclude,
+                    data=json.dumps(data),
+                    data_exclude=data_exclude,
+                )
+            )
+        return "\n_SITE_PACKAGES_BUILD_FILE_CONTENT='''\n{}'''\n".format("".join(contents))
+
+    def _archive_extra_attrs(self) -> str:
+        """Additional attributes for each http_archive, one per line"""
+        lines = []
+        if self.precompile:
+            options = ""
+            if int(self.desired_python) >= 37:
+                options = "--invalidation-mode unchecked-hash "
+            cmd = PRECOMPILE_CMD.format(python=self.desired_python_full, options=options)
+            lines.append(_space(12) + "patch_cmds = [{}],\n".format(json.dumps(cmd)))
+        return "".join(lines)
+
     def _get_wheelname_from_link(self, wheel_link: str) -> str:
         """Give a wheel url, return the filename.
 
@@ -349,27 +1680,32 @@ class RequirementsToBazelLibGenerator:
         else:
             return ""
 
-    def _get_wheel_links(self) -> dict:
+    def _get_wheel_links(self) -> typing.Tuple[dict, typing.List[str]]:
+        """Run pip wheel, return the wheel links it found and the wheels it produced
+
+        The wheel dir may be reused across runs, so it can have other wheels
+        too; only the ones pip logged are part of this run.
+        """
         wheel_links = {}
+        wheel_filenames = set()
         logger.info("Calling pip wheel on: %s", self.requirements_path)
         start = time.time()
-        proc = subprocess.Popen(
-            shlex.split(
-                "{} -m pip wheel --verbose --disable-pip-version-check "
-                "--requirement {} --wheel-dir {}".format(
-                    self.desired_python_full, self.requirements_path, self.wheel_dir
-                )
-            ),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-        )
-        out, err = proc.communicate()
-        if proc.returncode != 0:
-            raise PyBazelRuleGeneratorException(
-                "Pip call caused an error: {}".format(err)
-            )
+        out = self._call_pip([
+            "wheel",
+            "--verbose",
+            "--disable-pip-version-check",
+            "--requirement",
+            self._pip_requirements_path,
+            "--wheel-dir",
+            self.wheel_dir,
+        ])
         for line in out.splitlines():
+            match = PIP_WHEEL_FILE_RE.search(line)
+            if match:
+                wheel_filenames.add(
+                    match.group("filename") or os.path.basename(match.group("path").strip())
+                )
+                continue
             match = WHEEL_LINK_RE.search(line)
             if match:
                 # get filename from link and then add to a lookup dict
@@ -378,19 +1714,164 @@ class RequirementsToBazelLibGenerator:
                 filename = self._get_wheelname_from_link(link)
                 logger.debug("Found link: %s for: %s", link, filename)
                 wheel_links[filename] = link
+                if match.group("digest"):
+                    self._wheel_digests[filename] = (
+                        match.group("digest_algo"),
+                        match.group("digest"),
+                    )
         end = time.time()
         logger.info("pip executed in %s seconds", (end - start) * 1000.0)
         logger.debug("found: %r", wheel_links)
-        return wheel_links
+        return wheel_links, sorted(wheel_filenames)
+
+    def _call_pip(
+        self, args: typing.List[str], marker_environment: typing.Optional[dict] = None
+    ) -> str:
+        cmd = [self.desired_python_full, "-m", "pip"]
+        if marker_environment:
+            cmd = [
+                self.desired_python_full,
+                "-c",
+                PIP_MAIN_WITH_MARKER_ENVIRONMENT.format(environment=marker_environment),
+            ]
+        if self.http_cache:
+            # pip keeps (and revalidates) index pages and metadata in its own http cache
+            args = args + ["--cache-dir", self.http_cache.pip_cache_dir]
+        proc = subprocess.Popen(
+            cmd + args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            raise PyBazelRuleGeneratorException(
+                "Pip call caused an error: {}".format(err)
+            )
+        return out
+
+    def _pip_report(self, platform: str) -> dict:
+        """Resolve the requirements for `platform` with pip, without downloading anything"""
+        with tempfile.TemporaryDirectory() as tmp:
+            report_path = os.path.join(tmp, "report.json")
+            args = [
+                "install",
+                "--dry-run",
+                "--ignore-installed",
+                "--quiet",
+                "--disable-pip-version-check",
+                "--report",
+                report_path,
+                "--requirement",
+                self._pip_requirements_path,
+                "--only-binary=:all:",
+                "--python-version",
+                self.desired_python,
+                "--target",
+                os.path.join(tmp, "target"),
+            ]
+            for tag in PLATFORM_TAGS[platform]:
+                args += ["--platform", tag]
+            logger.info(
+                "Calling pip install --report on: %s (%s)", self.requirements_path, platform
+            )
+            self._call_pip(args, PLATFORM_MARKER_ENVIRONMENTS[platform])
+            with open(report_path, "rt") as f:
+                return json.load(f)
+
+    def _resolve_platforms(self) -> typing.Set[DependencyInfo]:
+        """Resolve the requirements for each platform and merge the results
+
+        Each platform is resolved by its own pip process, all at the same
+        time, so this takes about as long as a single resolution. Wheels are
+        downloaded concurrently as well.
+
+        Subdependencies that all platforms share become the dependencies of a
+        DependencyInfo, the others (and dependencies that only exist on some
+        platforms) its platform dependencies.
+        """
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.platforms)) as executor:
+            reports = executor.map(self._pip_report, self.platforms)
+            resolved = {
+                platform: _parse_pip_report(report, PLATFORM_MARKER_ENVIRONMENTS[platform])
+                for platform, report in zip(self.platforms, reports)
+            }
+        logger.info("pip executed in %s seconds", (time.time() - start) * 1000.0)
+        self._report_progress("resolve", 1, 1)
+
+        distributions = {}
+        for platform_resolved in resolved.values():
+            for distribution in platform_resolved.values():
+                distributions.setdefault(distribution.filename, distribution)
+        wheels = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            results = executor.map(self._resolved_wheel, distributions.values())
+            for filename, wheel in zip(distributions, results):
+                wheels[filename] = wheel
+                self._report_progress("wheels", len(wheels), len(distributions))
+
+        all_deps = set()
+        names = set().union(*resolved.values()) - BLACKLIST
+        for name in sorted(names):
+            by_platform = {
+                platform: platform_resolved[name]
+                for platform, platform_resolved in resolved.items()
+                if name in platform_resolved
+            }
+            versions = {distribution.version for distribution in by_platform.values()}
+            if len(versions) > 1:
+                raise PyBazelRuleGeneratorException(
+                    "{} resolves to different versions per platform: {}, pin it".format(
+                        name, sorted(versions)
+                    )
+                )
+            subdeps = {
+                platform: (distribution.requires & set(resolved[platform])) - BLACKLIST
+                for platform, distribution in by_platform.items()
+            }
+            common = set.intersection(*subdeps.values())
+            extras = {}
+            for distribution in by_platform.values():
+                for extra, extra_deps in distribution.extras.items():
+                    extras.setdefault(extra, set()).update(extra_deps - BLACKLIST)
+            dependency = DependencyInfo(name=name, deps=common, extras=extras)
+            dependency.platform_dependencies = {
+                platform: sorted(platform_subdeps - common)
+                for platform, platform_subdeps in subdeps.items()
+                if platform_subdeps - common
+            }
+            for distribution in by_platform.values():
+                dependency.add_wheel(wheels[distribution.filename])
+            dependency.modules = Wheel(dependency.wheels[0].filepath).top_level_modules()
+            all_deps.add(dependency)
+        return all_deps
+
+    def _resolved_wheel(self, distribution: ResolvedDistribution) -> WheelInfo:
+        filepath = os.path.join(self.wheel_dir, distribution.filename)
+        _download(distribution.url, filepath, distribution.digest, self.http_cache)
+        sha256sum = None
+        if distribution.digest and distribution.digest[0] == "sha256":
+            sha256sum = distribution.digest[1]  # verified by _download
+        match = WHEEL_FILE_RE.search(distribution.filename)
+        return WheelInfo(
+            name=match.group("name"),
+            filepath=filepath,
+            url=distribution.url,
+            version=match.group("ver"),
+            sha256sum=sha256sum,
+        )
 
-    def _parse_wheel_dependencies(self, wheel_links: str) -> typing.Set[DependencyInfo]:
+    def _parse_wheel_dependencies(
+        self, wheel_links: dict, wheel_filenames: typing.List[str]
+    ) -> typing.Set[DependencyInfo]:
         """Parse wheel dependencies
 
         Build a set of dependency structs and the wheels that correspond
         with them.
 
-        1. For each wheel that pip downloaded, create a DependencyInfo
-        struct and add the wheel to it
+        1. For each wheel that pip downloaded (`wheel_filenames`), create a
+        DependencyInfo struct and add the wheel to it
         2. Then find any additional wheels that belong to that dependency
         for other platforms
 
@@ -404,12 +1885,22 @@ class RequirementsToBazelLibGenerator:
         # at this point pip has installed all deps+subdeps inside our
         # wheel_dir, even though we're dealing with wheel files, we are
         # really iterating through our full dependency set
-        for wheel_filepath in glob.glob("{}/*.whl".format(self.wheel_dir)):
+        wheel_filepaths = [
+            os.path.join(self.wheel_dir, filename)
+            for filename in wheel_filenames
+            if os.path.exists(os.path.join(self.wheel_dir, filename))
+        ]
+        if not wheel_filepaths:
+            logger.warning(
+                "Found no wheels in pip's output, using all wheels in %s", self.wheel_dir
+            )
+            wheel_filepaths = glob.glob("{}/*.whl".format(self.wheel_dir))
+        for i, wheel_filepath in enumerate(wheel_filepaths, 1):
             logger.info("\nProcessing wheelinfo for %s", wheel_filepath)
             wheel = Wheel(wheel_filepath)
             extra_deps = {}
             for extra in wheel.extras():
-                extra_deps[extra] = list(wheel.dependencies(extra=extra))
+                extra_deps[extra] = set(wheel.dependencies(extra=extra)) - BLACKLIST
 
             logger.debug("Wheel name is: %s", wheel.name())
             dependency = DependencyInfo(
@@ -417,6 +1908,7 @@ class RequirementsToBazelLibGenerator:
                 deps=set(wheel.dependencies()) - BLACKLIST,
                 extras=extra_deps,
             )
+            dependency.modules = wheel.top_level_modules()
 
             wheel_filename = os.path.basename(wheel_filepath)
 
@@ -455,7 +1947,12 @@ class RequirementsToBazelLibGenerator:
                         logger.debug(
                             "%s does not equal %s", wheel_filename, additional_filename
                         )
-                        _download(additional_link, filepath)
+                        _download(
+                            additional_link,
+                            filepath,
+                            self._wheel_digests.get(additional_filename),
+                            self.http_cache,
+                        )
 
                     logger.debug("Matched %s %s", match_prefix, additional_filename)
 
@@ -474,10 +1971,20 @@ class RequirementsToBazelLibGenerator:
                         "Dependency {} is missing wheels!".format(dependency)
                     )
                 all_deps.add(dependency)
+            self._report_progress("wheels", i, len(wheel_filepaths))
         return all_deps
 
     def _gen_output_file(self, deps) -> None:
-        """Output a file with the following structure
+        """Render the output file and write it to `output_file`"""
+        self._write_output_file(self.render(deps))
+
+    def _write_output_file(self, content: str) -> None:
+        # the output file is never left half written
+        atomic_write(self.output_file, content)
+        logger.info("Finished writing to output file: %s", self.output_file)
+
+    def render(self, deps) -> str:
+        """Render the bzl file for `deps` with the following structure
 
         def pypi_libraries():
             py_library(
@@ -495,17 +2002,25 @@ class RequirementsToBazelLibGenerator:
                     name="pypi_asn1crypto",
                     url="https://files.pythonhosted...",
                     sha256="2f1adbb7546ed199e3c90ef23ec95c5cf3585bac7d11fb7eb562a3fe89c64e87",
+                    canonical_id="https://files.pythonhosted...",
                     build_file_content=_BUILD_FILE_CONTENT,
                     type="zip",
                 )
         """
-        f = tempfile.NamedTemporaryFile(delete=False, mode="w+t")
+        f = io.StringIO()
         # sort the deps for better diffs
         sorted_deps = list(deps)
         sorted_deps.sort(key=operator.attrgetter("name"))
+        resolved = {dependency.name for dependency in sorted_deps}
+        build_file_constants = self._build_file_constants(sorted_deps)
 
         # header
-        f.write(HEADER)
+        f.write(HEADER.format(fingerprint=self.fingerprint()))
+        if self.layout == LAYOUT_SITE_PACKAGES:
+            f.write(SITE_PACKAGES_RULE)
+            f.write(self._site_packages_build_file(sorted_deps))
+        else:
+            f.write(self._build_file_contents(build_file_constants))
         f.write("\ndef pypi_libraries():\n\n")
 
         # py_libraries
@@ -517,54 +2032,94 @@ class RequirementsToBazelLibGenerator:
             for subdependency in dependency.dependencies:
                 f.write(_space(12) + '"{}",\n'.format(subdependency))
             f.write(_space(8) + "]")
+            if dependency.platform_dependencies:
+                # subdependencies that only some platforms need
+                f.write(" + select({\n")
+                for platform in self.platforms:
+                    f.write(
+                        _space(12) + '"@//tool_bazel:{}": {},\n'.format(
+                            platform,
+                            json.dumps(dependency.platform_dependencies.get(platform, [])),
+                        )
+                    )
+                f.write(_space(8) + "})")
             logger.debug("Found %r dependency wheels", dependency.wheels)
             if len(dependency.wheels) == 0:
                 # TODO(c4urself): weird case, investigate
                 raise PyBazelRuleGeneratorException(
                     "No wheels for dependency: {}".format(dependency)
                 )
-            if len(dependency.wheels) == 1:
+            if self.layout == LAYOUT_SITE_PACKAGES:
+                # the repository only has the wheels for the host platform
+                f.write(' + ["@{}//:{}"],\n'.format(self.site_packages_repository, dependency.name))
+            elif dependency.wheels[0].platform == "purelib":
                 # one platform-less/purelib wheel exists
                 f.write(' + ["{}"],\n'.format(dependency.wheels[0].lib_path))
             else:
                 # multiple platform/platlib wheels exist
                 f.write(" + select({\n")
-                sorted_wheels = dependency.wheels
-                sorted_wheels.sort(key=operator.attrgetter("platform"))
-                for wheel in sorted_wheels:
-                    if wheel.platform == "linux":
-                        f.write(
-                            _space(12)
-                            + '"@//tool_bazel:linux": ["{}"],\n'.format(wheel.lib_path)
-                        )
-                    elif wheel.platform == "macos":
-                        f.write(
-                            _space(12)
-                            + '"@//tool_bazel:macos": ["{}"],\n'.format(wheel.lib_path)
+                lib_paths = {
+                    wheel.platform: '["{}"]'.format(wheel.lib_path) for wheel in dependency.wheels
+                }
+                # a dependency that doesn't exist on some platforms has nothing there
+                for platform in sorted(set(lib_paths) | set(self.platforms)):
+                    f.write(
+                        _space(12)
+                        + '"@//tool_bazel:{}": {},\n'.format(
+                            platform, lib_paths.get(platform, "[]")
                         )
+                    )
                 f.write(_space(8) + "}),\n")
             f.write(_space(8) + 'visibility=["//visibility:public"],\n')
             f.write(_space(4) + ")\n\n")
 
+            # extras, the library plus the additional subdependencies
+            for name, extra_deps in dependency.extra_targets(resolved):
+                f.write(_space(4) + "py_library(\n")
+                f.write(_space(8) + 'name = "{}",\n'.format(name))
+                f.write(_space(8) + "deps = [\n")
+                for subdependency in [dependency.name] + extra_deps:
+                    f.write(_space(12) + '"{}",\n'.format(subdependency))
+                f.write(_space(8) + "],\n")
+                f.write(_space(8) + 'visibility=["//visibility:public"],\n')
+                f.write(_space(4) + ")\n\n")
+
         f.write("\n\ndef pypi_archives():\n")
         f.write(_space(4) + "existing_rules = native.existing_rules()")
 
         # archives
-        for dependency in sorted_deps:
-            sorted_wheels = dependency.wheels
-            sorted_wheels.sort(key=operator.attrgetter("platform"))
-            for wheel in sorted_wheels:
-                f.write(
-                    ARCHIVE_TMPL.format(
-                        archive_name=wheel.archive_name,
-                        url=wheel.url,
-                        sha256=wheel.sha256sum,
+        extra_attrs = self._archive_extra_attrs()
+        if self.layout == LAYOUT_SITE_PACKAGES:
+            wheels = []
+            for dependency in sorted_deps:
+                for wheel in dependency.wheels:
+                    attrs = [wheel.url, wheel.sha256sum, wheel.platform]
+                    attrs += self._wheel_urls(wheel)[:-1]  # mirrors
+                    wheels.append(
+                        _space(16) + '"{}": {},\n'.format(wheel.archive_name, json.dumps(attrs))
                     )
+            f.write(
+                SITE_PACKAGES_TMPL.format(
+                    repository_name=self.site_packages_repository,
+                    wheels="".join(wheels),
+                    extra_attrs=extra_attrs,
                 )
+            )
+        else:
+            for dependency in sorted_deps:
+                build_file_content = build_file_constants[dependency.name]
+                for wheel in dependency.wheels:
+                    f.write(
+                        ARCHIVE_TMPL.format(
+                            archive_name=wheel.archive_name,
+                            urls=json.dumps(self._wheel_urls(wheel)),
+                            url=wheel.url,
+                            sha256=wheel.sha256sum,
+                            build_file_content=build_file_content,
+                            extra_attrs=extra_attrs,
+                        )
+                    )
 
         # footer
         f.write(FOOTER.format(self.bzl_path))
-        logger.info("Finished writing to output file: %s", self.output_file)
-        f.close()
-        shutil.copy(f.name, self.output_file)
-        os.remove(f.name)
+        return f.getvalue()
@@ -108,6 +108,7 @@ def split_extra_from_environment_marker(environment_marker):
 class Wheel(object):
     def __init__(self, path):
         self._path = path
+        self._metadata = None
 
     def path(self):
         return self._path
@@ -138,6 +139,13 @@ class Wheel(object):
         return "{}-{}.dist-info".format(self.distribution(), self.version())
 
     def metadata(self):
+        # The metadata is read for the name, the dependencies and those of every
+        # extra, only open the zip once.
+        if self._metadata is None:
+            self._metadata = self._read_metadata()
+        return self._metadata
+
+    def _read_metadata(self):
         # Extract the structured data from metadata.json in the WHL's dist-info
         # directory.
         with zipfile.ZipFile(self.path(), "r") as whl:
@@ -193,6 +201,59 @@ class Wheel(object):
     def extras(self):
         return self.metadata().get("extras", [])
 
+    def top_level_modules(self):
+        """Return the names of the modules this wheel provides.
+
+        These come from top_level.txt if the wheel has one, otherwise from the
+        wheel's file list. Namespace packages (top level directories without
+        an __init__.py, like `google`) are listed with their subpackages
+        instead, as `google.protobuf`, since the top level name is shared
+        with other wheels.
+        """
+        with zipfile.ZipFile(self.path(), "r") as whl:
+            filenames = whl.namelist()
+            try:
+                with whl.open(self._dist_info() + "/top_level.txt") as f:
+                    top_level = f.read().decode("utf-8").split()
+            except KeyError:
+                top_level = None
+
+        if top_level is None:
+            top_level = set()
+            for filename in filenames:
+                top, sep, _ = filename.partition("/")
+                if sep and not top.endswith((".dist-info", ".data")):
+                    top_level.add(top)
+                elif not sep and top.endswith(".py"):
+                    top_level.add(top[:-3])
+                elif not sep and top.endswith((".so", ".pyd")):
+                    top_level.add(top.split(".")[0])
+
+        modules = set()
+        files = set(filenames)
+        for name in top_level:
+            name = name.replace("/", ".")
+            path = name.replace(".", "/")
+            if "{}/__init__.py".format(path) in files or "{}.py".format(path) in files:
+                modules.add(name)
+                continue
+            subpackages = {
+                filename[len(path) + 1:].split("/")[0]
+                for filename in filenames
+                if filename.startswith(path + "/")
+            }
+            subpackages = {
+                sub[:-3] if sub.endswith(".py") else sub
+                for sub in subpackages
+                if sub.endswith(".py") or "." not in sub
+            }
+            if subpackages:
+                modules.update("{}.{}".format(name, sub) for sub in subpackages)
+            else:
+                # a compiled extension module
+                modules.add(name)
+        return sorted(modules)
+
     def expand(self, directory):
         with zipfile.ZipFile(self.path(), "r") as whl:
             whl.extractall(directory)
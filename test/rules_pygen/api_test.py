@@ -0,0 +1,99 @@
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+def _call_pip(args, marker_environment):
+    from . import fakes
+
+    fakes.write_report(args, [
+        fakes.report_item("six-1.13.0-py2.py3-none-any.whl", "six", digest="a" * 64),
+        fakes.report_item("app-1.0-py3-none-any.whl", "app", ["six"], digest="b" * 64),
+    ])
+    return ""
+
+
+class WhenUsingTheApiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.reqs = os.path.join(self.tmp, "requirements.txt")
+        with open(self.reqs, "w") as f:
+            f.write("app==1.0\n")
+        from . import fakes
+
+        fakes.patch_pip(self, _call_pip)
+
+    def test_that_the_model_is_returned_without_writing_files(self):
+        from rules_pygen import generate
+
+        progress = []
+        result = generate(
+            self.reqs,
+            "//3rdparty/python",
+            resolver="pip-report",
+            platforms=["linux"],
+            progress=lambda *args: progress.append(args),
+        )
+
+        self.assertEqual([d.name for d in result.dependencies], ["app", "six"])
+        self.assertEqual(result.dependency("App").dependencies, ["six"])
+        self.assertEqual(result.hashes, {
+            "app-1.0-py3-none-any.whl": "b" * 64,
+            "six-1.13.0-py2.py3-none-any.whl": "a" * 64,
+        })
+        self.assertIn('name = "pypi__app_1_0",', result.text)
+        self.assertIn("# Fingerprint: {}".format(result.fingerprint), result.text)
+        self.assertEqual(progress, [
+            ("resolve", 1, 1), ("wheels", 1, 2), ("wheels", 2, 2), ("render", 1, 1),
+        ])
+        self.assertEqual(os.listdir(self.tmp), ["requirements.txt"])
+
+    def test_that_the_output_file_is_written_and_checked(self):
+        from rules_pygen import check, generate
+
+        output_file = os.path.join(self.tmp, "requirements.bzl")
+        wheel_dir = os.path.join(self.tmp, "wheels")
+        options = dict(resolver="pip-report", platforms=["linux"])
+        result = generate(
+            self.reqs, "//3rdparty/python", output_file=output_file, wheel_dir=wheel_dir,
+            **options
+        )
+
+        with open(output_file) as f:
+            self.assertEqual(f.read(), result.text)
+        self.assertTrue(all(os.path.exists(wheel.filepath) for wheel in result.wheels))
+        self.assertTrue(check(self.reqs, output_file, "//3rdparty/python", **options))
+        self.assertFalse(check(self.reqs, output_file, "//3rdparty/python"))
+
+    def test_that_importing_does_not_configure_logging(self):
+        import rules_pygen
+
+        code = (
+            "import logging, sys, rules_pygen.rules_generator;"
+            "sys.exit(len(logging.getLogger().handlers))"
+        )
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(rules_pygen.__file__))),
+        )
+        self.assertEqual(subprocess.call([sys.executable, "-c", code], env=env), 0)
@@ -0,0 +1,53 @@
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Fakes of pip and the wheel downloads, for tests that run the generator"""
+import json
+import unittest.mock
+import zipfile
+
+
+def report_item(filename, name, requires_dist=(), digest="0" * 64):
+    """The entry of a pip installation report for the wheel `filename`"""
+    return {
+        "download_info": {
+            "url": "https://files.example.org/packages/" + filename,
+            "archive_info": {"hash": "sha256=" + digest, "hashes": {"sha256": digest}},
+        },
+        "metadata": {"name": name, "requires_dist": list(requires_dist)},
+    }
+
+
+def write_report(args, items):
+    """Write a report of `items` where the pip `args` ask for it"""
+    with open(args[args.index("--report") + 1], "w") as f:
+        json.dump({"install": list(items)}, f)
+
+
+def download(url, dest, digest=None, cache=None):
+    """Write a wheel with a module named like the distribution of `url` to `dest`"""
+    with zipfile.ZipFile(dest, "w") as zf:
+        zf.writestr(url.rsplit("/", 1)[-1].split("-")[0] + ".py", "")
+
+
+def patch_pip(test_case, call_pip):
+    """Run the generator with `call_pip` and fake downloads for `test_case`"""
+    for target, mock in (
+        ("rules_pygen.rules_generator.RequirementsToBazelLibGenerator._call_pip", call_pip),
+        ("rules_pygen.rules_generator._download", download),
+    ):
+        patcher = unittest.mock.patch(target, side_effect=mock)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
@@ -0,0 +1,55 @@
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+
+class WhenWritingFilesAtomicallyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.dest = os.path.join(self.tmp, "dest.txt")
+        with open(self.dest, "w") as f:
+            f.write("old")
+
+    def test_that_files_are_replaced(self):
+        from rules_pygen.fileutil import atomic_copy, atomic_write
+
+        src = os.path.join(self.tmp, "src.txt")
+        with open(src, "w") as f:
+            f.write("copied")
+        atomic_copy(src, self.dest, 0o644)
+        with open(self.dest) as f:
+            self.assertEqual(f.read(), "copied")
+        self.assertEqual(stat.S_IMODE(os.stat(self.dest).st_mode), 0o644)
+
+        atomic_write(self.dest, "written")
+        with open(self.dest) as f:
+            self.assertEqual(f.read(), "written")
+        self.assertEqual(sorted(os.listdir(self.tmp)), ["dest.txt", "src.txt"])
+
+    def test_that_failed_copies_leave_the_destination_alone(self):
+        from rules_pygen.fileutil import atomic_copy
+
+        with self.assertRaises(FileNotFoundError):
+            atomic_copy(os.path.join(self.tmp, "missing.txt"), self.dest)
+        with open(self.dest) as f:
+            self.assertEqual(f.read(), "old")
+        self.assertEqual(os.listdir(self.tmp), ["dest.txt"])
@@ -0,0 +1,141 @@
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import hashlib
+import http.server
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+
+
+def _wheel_bytes(content):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("foo/__init__.py", content)
+    return buf.getvalue()
+
+
+class _ValidatingHandler(http.server.BaseHTTPRequestHandler):
+    """Serves `body` with validators, answering 304 to matching conditional requests"""
+
+    body = b""
+    etag = None
+    last_modified = None
+    requests = []
+
+    def do_GET(self):
+        cls = type(self)
+        if_none_match = self.headers.get("If-None-Match")
+        if_modified_since = self.headers.get("If-Modified-Since")
+        cls.requests.append((if_none_match, if_modified_since))
+        if (if_none_match and if_none_match == cls.etag) or (
+            not if_none_match and if_modified_since and if_modified_since == cls.last_modified
+        ):
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if cls.etag:
+            self.send_header("ETag", cls.etag)
+        if cls.last_modified:
+            self.send_header("Last-Modified", cls.last_modified)
+        self.send_header("Content-Length", str(len(cls.body)))
+        self.end_headers()
+        self.wfile.write(cls.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class WhenCachingDownloadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = type("Handler", (_ValidatingHandler,), {
+            "body": _wheel_bytes("v1"), "etag": '"v1"', "requests": [],
+        })
+        self.server = http.server.HTTPServer(("127.0.0.1", 0), self.handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}/foo-1.0-py3-none-any.whl".format(self.server.server_port)
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmp)
+
+    def _download(self, cache, run, digest=None):
+        from rules_pygen.rules_generator import _download
+
+        dest_dir = os.path.join(self.tmp, "run{}".format(run))
+        os.makedirs(dest_dir)
+        dest = os.path.join(dest_dir, "foo-1.0-py3-none-any.whl")
+        _download(self.url, dest, digest, cache)
+        with open(dest, "rb") as f:
+            return f.read()
+
+    def test_that_unchanged_bodies_are_revalidated(self):
+        from rules_pygen.http_cache import HttpCache
+
+        cache = HttpCache(os.path.join(self.tmp, "cache"))
+        self.assertEqual(self._download(cache, 1), self.handler.body)
+        self.assertEqual(self._download(cache, 2), self.handler.body)
+
+        self.assertEqual(self.handler.requests, [(None, None), ('"v1"', None)])
+        self.assertEqual(cache.stats, {"hit": 0, "not_modified": 1, "miss": 1})
+        self.assertEqual(cache.hit_ratio, 0.5)
+
+    def test_that_last_modified_is_used_without_an_etag(self):
+        from rules_pygen.http_cache import HttpCache
+
+        self.handler.etag = None
+        self.handler.last_modified = "Wed, 21 Oct 2015 07:28:00 GMT"
+        cache = HttpCache(os.path.join(self.tmp, "cache"))
+        self._download(cache, 1)
+        self._download(cache, 2)
+
+        self.assertEqual(self.handler.requests[1], (None, "Wed, 21 Oct 2015 07:28:00 GMT"))
+        self.assertEqual(cache.stats["not_modified"], 1)
+
+    def test_that_changed_bodies_are_downloaded_again(self):
+        from rules_pygen.http_cache import HttpCache
+
+        cache = HttpCache(os.path.join(self.tmp, "cache"))
+        self._download(cache, 1)
+        self.handler.body = _wheel_bytes("v2")
+        self.handler.etag = '"v2"'
+        self.assertEqual(self._download(cache, 2), self.handler.body)
+        self.assertEqual(self._download(cache, 3), self.handler.body)
+
+        # the changed body comes with the answer to the conditional request
+        self.assertEqual(self.handler.requests, [(None, None), ('"v1"', None), ('"v2"', None)])
+        self.assertEqual(cache.stats, {"hit": 0, "not_modified": 1, "miss": 2})
+
+    def test_that_bodies_matching_the_digest_need_no_request(self):
+        from rules_pygen.http_cache import HttpCache
+
+        digest = ("sha256", hashlib.sha256(self.handler.body).hexdigest())
+        cache = HttpCache(os.path.join(self.tmp, "cache"))
+        self._download(cache, 1, digest)
+        self.assertEqual(self._download(cache, 2, digest), self.handler.body)
+
+        self.assertEqual(len(self.handler.requests), 1)
+        self.assertEqual(cache.stats, {"hit": 1, "not_modified": 0, "miss": 1})
+        self.assertEqual(cache.summary(), "1 hits, 0 not modified, 1 misses (hit ratio 50%)")
@@ -0,0 +1,97 @@
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+
+INDEX = {
+    "modules": {
+        "coolname": ["coolname"],
+        "dateutil": ["python_dateutil"],
+        "freezegun": ["freezegun"],
+        "google.protobuf": ["protobuf"],
+        "mock": ["mock"],
+        "pbr": ["pbr"],
+        "six": ["six"],
+    },
+    "dependencies": {
+        "coolname": [],
+        "freezegun": ["python_dateutil", "six"],
+        "mock": ["pbr", "six"],
+        "pbr": [],
+        "protobuf": ["six"],
+        "python_dateutil": ["six"],
+        "six": [],
+    },
+}
+
+
+class WhenAuditingImportsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _write(self, path, content):
+        path = os.path.join(self.tmp, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_that_requirements_are_read(self):
+        from rules_pygen.import_audit import read_requirements
+
+        reqs = self._write("requirements.txt", "-r base.txt\n--index-url https://x\nMock==2.0.0  # testing\n")
+        self._write("base.txt", "python-dateutil>=2\n\n# comment\n")
+        self.assertEqual(read_requirements(reqs), {"mock", "python_dateutil"})
+
+    def test_that_unused_and_missing_requirements_are_found(self):
+        from rules_pygen.import_audit import audit
+
+        self._write("component_a/greeting.py", "import coolname\nfrom google import protobuf\n")
+        self._write("component_a/greet.py", "import json\nfrom component_a import greeting\n")
+        self._write("component_b/clock.py", "from freezegun import freeze_time\nimport requests.adapters\n")
+        self._write("component_b/helpers/__init__.py", "from . import foo\nimport helpers\n")
+
+        result = audit(
+            INDEX,
+            {"coolname", "freezegun", "mock", "protobuf", "six"},
+            [os.path.join(self.tmp, "component_a"), os.path.join(self.tmp, "component_b")],
+        )
+        # six is only used through freezegun and protobuf, but that still counts
+        self.assertEqual(result.unused, ["mock"])
+        self.assertEqual(
+            result.missing, {"requests": [os.path.join(self.tmp, "component_b/clock.py")]}
+        )
+        self.assertTrue(result)
+
+    def test_that_directories_above_the_roots_are_not_first_party(self):
+        from rules_pygen.import_audit import audit
+
+        app = self._write("requests/src/app/main.py", "import requests\nfrom app import util\n")
+        self._write("requests/src/app/util.py", "")
+        result = audit(INDEX, set(), [os.path.join(self.tmp, "requests", "src")])
+        self.assertEqual(result.missing, {"requests": [app]})
+
+    def test_that_a_clean_repository_passes(self):
+        from rules_pygen.import_audit import audit
+
+        self._write("src/app.py", "import six\nimport os.path\n")
+        result = audit(INDEX, {"six"}, [os.path.join(self.tmp, "src")])
+        self.assertFalse(result)
@@ -0,0 +1,204 @@
+#
+# Copyright 2019 Tubular Labs, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+
+# what pip resolves for each requirement, app and tool share six
+RESOLUTIONS = {
+    "app": [("app", "1.0", ["six"]), ("six", "1.13.0", [])],
+    "tool": [("tool", "2.0", ["six"]), ("six", "1.13.0", [])],
+    "idna": [("idna", "2.8", [])],
+    "old": [("old", "0.1", ["six"]), ("six", "1.12.0", [])],
+}
+
+
+def _call_pip(args, marker_environment):
+    from . import fakes
+
+    with open(args[args.index("--requirement") + 1]) as f:
+        requirements = [line.split("==")[0] for line in f.read().splitlines()]
+    install = {}
+    for requirement in requirements:
+        for name, version, requires in RESOLUTIONS.get(requirement, []):
+            filename = "{}-{}-py3-none-any.whl".format(name, version)
+            digest = "{:0>64}".format(filename[:8].encode().hex())
+            install[name] = fakes.report_item(filename, name, requires, digest)
+    fakes.write_report(args, install.values())
+    return ""
+
+
+class WhenShardingRequirementsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.reqs = os.path.join(self.tmp, "requirements.txt")
+        self._write_requirements("app==1.0", "tool==2.0", "idna==2.8")
+        from . import fakes
+
+        fakes.patch_pip(self, _call_pip)
+
+    def _write_requirements(self, *requirements):
+        with open(self.reqs, "w") as f:
+            f.write("\n".join(requirements) + "\n")
+
+    def _shards(self, count, **options):
+        from rules_pygen import generate
+
+        paths = []
+        for index in range(1, count + 1):
+            path = os.path.join(self.tmp, "shard-{}.json".format(index))
+            generate(
+                self.reqs,
+                "//3rdparty/python",
+                wheel_dir=os.path.join(self.tmp, "wheels-{}".format(index)),
+                resolver="pip-report",
+                shard=(index, count),
+                partial_output=path,
+                **options
+            )
+            paths.append(path)
+        return paths
+
+    def test_that_requirements_are_dealt_out_round_robin(self):
+        from rules_pygen.rules_generator import _shard_requirements
+
+        with open(os.path.join(self.tmp, "requirements.txt"), "w") as f:
+            f.write("\n".join([
+                "# pinned",
+                "--index-url https://pypi.example.org/simple",
+                "-c constraints.txt",
+                "a==1",
+                "",
+                "b==1  # comment",
+                "c==1",
+                "d==1",
+                "e==1",
+            ]))
+        dest = os.path.join(self.tmp, "shard.txt")
+
+        self.assertEqual(_shard_requirements(self.reqs, 1, 2, dest), 3)
+        with open(dest) as f:
+            self.assertEqual(f.read().splitlines(), [
+                "--index-url https://pypi.example.org/simple",
+                "-c {}".format(os.path.join(self.tmp, "constraints.txt")),
+                "a==1",
+                "c==1",
+                "e==1",
+            ])
+        self.assertEqual(_shard_requirements(self.reqs, 2, 2, dest), 2)
+
+    def test_that_hashes_stay_with_their_requirement(self):
+        from rules_pygen.rules_generator import _shard_requirements
+
+        self._write_requirements(
+            "--index-url https://pypi.example.org/simple",
+            "six==1.16.0 \\",
+            "    --hash=sha256:aaa \\",
+            "    --hash=sha256:ccc",
+            "    # via requests",
+            "requests==2.22.0 \\",
+            "    --hash=sha256:bbb",
+        )
+        dest = os.path.join(self.tmp, "shard.txt")
+
+        self.assertEqual(_shard_requirements(self.reqs, 1, 2, dest), 1)
+        with open(dest) as f:
+            self.assertEqual(f.read().splitlines(), [
+                "--index-url https://pypi.example.org/simple",
+                "six==1.16.0 --hash=sha256:aaa --hash=sha256:ccc",
+            ])
+        self.assertEqual(_shard_requirements(self.reqs, 2, 2, dest), 1)
+        with open(dest) as f:
+            self.assertEqual(f.read().splitlines(), [
+                "--index-url https://pypi.example.org/simple",
+                "requests==2.22.0 --hash=sha256:bbb",
+            ])
+
+    def test_that_url_fragments_are_not_comments(self):
+        from rules_pygen.rules_generator import _shard_requirements
+
+        self._write_requirements(
+            "foo @ https://example.org/foo-1.0-py3-none-any.whl#sha256=abc  # pinned",
+            "-e git+https://example.org/bar.git#egg=bar",
+        )
+        dest = os.path.join(self.tmp, "shard.txt")
+
+        self.assertEqual(_shard_requirements(self.reqs, 1, 2, dest), 1)
+        with open(dest) as f:
+            self.assertEqual(
+                f.read(), "foo @ https://example.org/foo-1.0-py3-none-any.whl#sha256=abc\n"
+            )
+        _shard_requirements(self.reqs, 2, 2, dest)
+        with open(dest) as f:
+            self.assertEqual(f.read(), "-e git+https://example.org/bar.git#egg=bar\n")
+
+    def test_that_merged_shards_render_like_a_single_run(self):
+        from rules_pygen import generate
+        from rules_pygen.merge import merge_files
+
+        output_file = os.path.join(self.tmp, "requirements.bzl")
+        result = merge_files(self.reqs, output_file, self._shards(2))
+        expected = generate(self.reqs, "//3rdparty/python", resolver="pip-report")
+
+        self.assertEqual(
+            [dependency.name for dependency in result.dependencies],
+            ["app", "idna", "six", "tool"],
+        )
+        with open(output_file) as f:
+            self.assertEqual(f.read(), expected.text)
+
+    def test_that_site_packages_shards_merge_without_their_wheels(self):
+        from rules_pygen import generate
+        from rules_pygen.merge import merge_files
+
+        output_file = os.path.join(self.tmp, "requirements.bzl")
+        partials = self._shards(2, layout="site-packages")
+        for index in (1, 2):
+            shutil.rmtree(os.path.join(self.tmp, "wheels-{}".format(index)))
+        merge_files(self.reqs, output_file, partials)
+        expected = generate(
+            self.reqs, "//3rdparty/python", resolver="pip-report", layout="site-packages"
+        )
+
+        with open(output_file) as f:
+            self.assertEqual(f.read(), expected.text)
+        self.assertIn('"six.py"', expected.text)
+
+    def test_that_inconsistent_pins_are_rejected(self):
+        from rules_pygen.merge import merge_files
+        from rules_pygen.rules_generator import PyBazelRuleGeneratorException
+
+        self._write_requirements("app==1.0", "old==0.1")
+        with self.assertRaisesRegex(PyBazelRuleGeneratorException, "six resolves to"):
+            merge_files(self.reqs, os.path.join(self.tmp, "requirements.bzl"), self._shards(2))
+
+    def test_that_all_shards_of_the_current_requirements_are_needed(self):
+        from rules_pygen.merge import merge_files
+        from rules_pygen.rules_generator import PyBazelRuleGeneratorException
+
+        output_file = os.path.join(self.tmp, "requirements.bzl")
+        partials = self._shards(3)
+        with self.assertRaisesRegex(PyBazelRuleGeneratorException, "Expected shards"):
+            merge_files(self.reqs, output_file, partials[:2])
+
+        self._write_requirements("app==1.0")
+        with self.assertRaisesRegex(PyBazelRuleGeneratorException, "changed since"):
+            merge_files(self.reqs, output_file, partials)
+        self.assertFalse(os.path.exists(output_file))
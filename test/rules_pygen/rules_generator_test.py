@@ -13,9 +13,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import csv
+import hashlib
+import http.server
+import io
+import json
 import operator
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 import unittest.mock
+import zipfile
 
 
 class WhenGeneratingBuildFilesTest(unittest.TestCase):
@@ -48,6 +60,15 @@ class WhenGeneratingBuildFilesTest(unittest.TestCase):
         match = WHEEL_LINK_RE.search(plain_http)
         self.assertEqual(match.group('link'), 'http://pypi.tubularlabs.net/__packages/aiohttp_admin-0.0.1-py2.py3-none-any.whl')
 
+    def test_that_log_lines_carry_link_digests(self):
+        from rules_pygen.rules_generator import WHEEL_LINK_RE
+
+        line = """Found link https://files.pythonhosted.org/packages/65/26/six-1.13.0-py2.py3-none-any.whl#sha256=1f1b7d42e254082a9db6279deae68afb421ceba6158efa6131de7b3003ee93fd (from https://pypi.org/simple/six/), version: 1.13.0"""
+        match = WHEEL_LINK_RE.search(line)
+        self.assertEqual(match.group('link'), 'https://files.pythonhosted.org/packages/65/26/six-1.13.0-py2.py3-none-any.whl')
+        self.assertEqual(match.group('digest_algo'), 'sha256')
+        self.assertEqual(match.group('digest'), '1f1b7d42e254082a9db6279deae68afb421ceba6158efa6131de7b3003ee93fd')
+
     def test_that_wheel_compatibility_is_correct(self):
         from rules_pygen.rules_generator import _check_compatibility
 
@@ -170,9 +191,931 @@ class WhenGeneratingBuildFilesTest(unittest.TestCase):
         di.add_wheel(wi2)
         self.assertEqual(len(di.wheels), 1)
 
+    @unittest.mock.patch('rules_pygen.rules_generator._calc_sha256sum')
+    def test_that_wheel_info_fields_are_derived_once(self, mock_checksum):
+        from rules_pygen.rules_generator import WheelInfo
+
+        wi = WheelInfo(
+            '/path/to/Foo-1.4.5-cp37-cp37m-manylinux1_x86_64.whl',
+            'https://example.org',
+            'Foo',
+            '1.4.5',
+            sha256sum='abc123',
+        )
+        mock_checksum.assert_not_called()
+        self.assertFalse(hasattr(wi, '__dict__'))
+        self.assertEqual(wi.platform, 'linux')
+        self.assertEqual(wi.archive_name, 'pypi__foo_1_4_5__linux')
+        self.assertEqual(wi.lib_path, '@pypi__foo_1_4_5__linux//:pkg')
+        self.assertEqual(wi.sha256sum, 'abc123')
+
     def test_that_subdeps_are_correct(self):
         from rules_pygen.rules_generator import DependencyInfo
 
         di = DependencyInfo('foo', ['Baz', 'bar-Qux', 'QuzQuz'], [])
 
         self.assertEqual(di.dependencies, ['bar_qux', 'baz', 'quzquz'])
+
+
+def _make_wheel_bytes(size):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("foo/__init__.py", os.urandom(size))
+    return buf.getvalue()
+
+
+class _FlakyWheelHandler(http.server.BaseHTTPRequestHandler):
+    """Serves `body`, dropping the connection halfway for the first `drops` requests."""
+
+    body = b""
+    drops = 0
+    requests = []
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests.append(self.headers.get("Range"))
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header:
+            start = int(range_header.split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes {}-{}/{}".format(start, len(cls.body) - 1, len(cls.body))
+            )
+        else:
+            self.send_response(200)
+        payload = cls.body[start:]
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if cls.drops:
+            cls.drops -= 1
+            self.wfile.write(payload[:len(payload) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(2)
+            return
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class WhenDownloadingWheelsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.body = _make_wheel_bytes(256 * 1024)
+        handler = type("Handler", (_FlakyWheelHandler,), {"body": self.body, "requests": []})
+        self.handler = handler
+        self.server = http.server.HTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}/foo-1.0-py3-none-any.whl".format(self.server.server_port)
+        self.tmp = tempfile.mkdtemp()
+        self.dest = os.path.join(self.tmp, "foo-1.0-py3-none-any.whl")
+        patcher = unittest.mock.patch("rules_pygen.rules_generator.DOWNLOAD_RETRY_DELAY", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmp)
+
+    def test_that_dropped_connections_are_resumed(self):
+        from rules_pygen.rules_generator import _download
+
+        self.handler.drops = 2
+        digest = ("sha256", hashlib.sha256(self.body).hexdigest())
+        _download(self.url, self.dest, digest)
+
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), self.body)
+        self.assertFalse(os.path.exists(self.dest + ".part"))
+        self.assertEqual(len(self.handler.requests), 3)
+        self.assertIsNone(self.handler.requests[0])
+        self.assertTrue(self.handler.requests[1].startswith("bytes="))
+        self.assertTrue(self.handler.requests[2].startswith("bytes="))
+
+    def test_that_a_leftover_partial_file_is_resumed(self):
+        from rules_pygen.rules_generator import _download
+
+        with open(self.dest + ".part", "wb") as f:
+            f.write(self.body[:1000])
+        _download(self.url, self.dest)
+
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), self.body)
+        self.assertEqual(self.handler.requests, ["bytes=1000-"])
+
+    def test_that_a_digest_mismatch_is_not_kept(self):
+        from rules_pygen.rules_generator import _download, PyBazelRuleGeneratorException
+
+        with self.assertRaises(PyBazelRuleGeneratorException):
+            _download(self.url, self.dest, ("sha256", "0" * 64))
+        self.assertFalse(os.path.exists(self.dest))
+        self.assertFalse(os.path.exists(self.dest + ".part"))
+
+    def test_that_unknown_hash_algorithms_fall_back_to_a_zip_check(self):
+        from rules_pygen.rules_generator import _download
+
+        with self.assertLogs("rules_pygen.rules_generator", "WARNING") as logs:
+            _download(self.url, self.dest, ("sha3000", "0" * 64))
+
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), self.body)
+        self.assertIn("unknown hash algorithm sha3000", logs.output[0])
+
+    def test_that_valid_existing_files_are_not_downloaded_again(self):
+        from rules_pygen.rules_generator import _download
+
+        with open(self.dest, "wb") as f:
+            f.write(self.body)
+        _download(self.url, self.dest, ("sha256", hashlib.sha256(self.body).hexdigest()))
+        self.assertEqual(self.handler.requests, [])
+
+    def test_that_truncated_existing_files_are_replaced(self):
+        from rules_pygen.rules_generator import _download
+
+        with open(self.dest, "wb") as f:
+            f.write(self.body[:1000])
+        _download(self.url, self.dest)
+
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), self.body)
+        self.assertEqual(self.handler.requests, [None])
+
+
+class WhenCheckingOutputFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.reqs = os.path.join(self.tmp, "requirements.txt")
+        self.constraints = os.path.join(self.tmp, "constraints.txt")
+        self.bzl = os.path.join(self.tmp, "requirements.bzl")
+        with open(self.reqs, "w") as f:
+            f.write("-c constraints.txt\nsix==1.13.0\n")
+        with open(self.constraints, "w") as f:
+            f.write("six<2\n")
+
+    def _generator(self, python="37"):
+        from rules_pygen.rules_generator import RequirementsToBazelLibGenerator
+        return RequirementsToBazelLibGenerator(
+            self.reqs, None, self.bzl, "//3rdparty/python", python
+        )
+
+    def _write_output(self, fingerprint):
+        with open(self.bzl, "w") as f:
+            f.write("# AUTO GENERATED. DO NOT EDIT DIRECTLY.\n")
+            f.write("# Fingerprint: {}\n".format(fingerprint))
+
+    def test_that_fingerprint_covers_inputs(self):
+        fingerprint = self._generator().fingerprint()
+        self.assertEqual(fingerprint, self._generator().fingerprint())
+        self.assertNotEqual(fingerprint, self._generator(python="38").fingerprint())
+
+        with open(self.constraints, "a") as f:
+            f.write("mock<3\n")
+        self.assertNotEqual(fingerprint, self._generator().fingerprint())
+
+    def test_that_fingerprint_covers_the_output_templates(self):
+        from rules_pygen import rules_generator
+
+        fingerprint = self._generator().fingerprint()
+        with unittest.mock.patch.object(
+            rules_generator, "FOOTER", rules_generator.FOOTER + "# changed\n"
+        ):
+            self.assertNotEqual(fingerprint, self._generator().fingerprint())
+
+    def test_that_current_output_passes_check(self):
+        gen = self._generator()
+        self._write_output(gen.fingerprint())
+        self.assertTrue(gen.check())
+
+    def test_that_stale_output_fails_check(self):
+        gen = self._generator()
+        self._write_output(gen.fingerprint())
+        with open(self.reqs, "a") as f:
+            f.write("mock==2.0.0\n")
+        self.assertFalse(gen.check())
+
+    def test_that_missing_output_or_fingerprint_fails_check(self):
+        gen = self._generator()
+        self.assertFalse(gen.check())
+        with open(self.bzl, "w") as f:
+            f.write("# AUTO GENERATED. DO NOT EDIT DIRECTLY.\n")
+        self.assertFalse(gen.check())
+
+
+class WhenRenderingOutputFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.reqs = os.path.join(self.tmp, "requirements.txt")
+        self.bzl = os.path.join(self.tmp, "requirements.bzl")
+        with open(self.reqs, "w") as f:
+            f.write("six==1.13.0\n")
+
+    def _dependency(self, name, version, files):
+        from rules_pygen.rules_generator import DependencyInfo, WheelInfo
+
+        filename = "{}-{}-py2.py3-none-any.whl".format(name, version)
+        filepath = os.path.join(self.tmp, filename)
+        with zipfile.ZipFile(filepath, "w") as zf:
+            for path, content in files.items():
+                zf.writestr(path, content)
+        dependency = DependencyInfo(name, [], {})
+        dependency.add_wheel(WheelInfo(
+            filepath, "https://example.org/" + filename, name, version
+        ))
+        return dependency
+
+    @unittest.mock.patch('rules_pygen.rules_generator._calc_sha256sum', return_value="abc123")
+    def _render(self, mock_checksum, deps=None, **kwargs):
+        from rules_pygen.rules_generator import RequirementsToBazelLibGenerator
+
+        if deps is None:
+            deps = {self._dependency("six", "1.13.0", {"six.py": ""})}
+        gen = RequirementsToBazelLibGenerator(
+            self.reqs, self.tmp, self.bzl, "//3rdparty/python", "37", **kwargs
+        )
+        gen._gen_output_file(deps)
+        if gen.prune_report:
+            gen._write_prune_report(deps)
+        with open(self.bzl) as f:
+            return f.read()
+
+    def test_that_archives_are_not_precompiled_by_default(self):
+        output = self._render()
+        self.assertIn('name = "pypi__six_1_13_0"', output)
+        self.assertIn('sha256 = "abc123"', output)
+        self.assertNotIn("patch_cmds", output)
+
+    def test_that_archives_have_a_canonical_id(self):
+        output = self._render()
+        self.assertIn(
+            'canonical_id = "https://example.org/six-1.13.0-py2.py3-none-any.whl",', output
+        )
+
+    def test_that_archives_list_the_mirror_first(self):
+        output = self._render(mirror_url="https://mirror.example.com/wheels/")
+        self.assertIn(
+            'urls = ["https://mirror.example.com/wheels/six-1.13.0-py2.py3-none-any.whl",'
+            ' "https://example.org/six-1.13.0-py2.py3-none-any.whl"],',
+            output,
+        )
+        self.assertIn(
+            'canonical_id = "https://example.org/six-1.13.0-py2.py3-none-any.whl",', output
+        )
+
+        output = self._render(
+            mirror_url="https://mirror.example.com/wheels",
+            deps={self._dependency("torch", "1.4.0+cpu", {"torch/__init__.py": ""})},
+        )
+        self.assertIn(
+            '"https://mirror.example.com/wheels/torch-1.4.0%2Bcpu-py2.py3-none-any.whl"', output
+        )
+
+        output = self._render(
+            mirror_url="https://mirror.example.com/wheels", layout="site-packages"
+        )
+        self.assertIn(
+            '"pypi__six_1_13_0": ["https://example.org/six-1.13.0-py2.py3-none-any.whl",'
+            ' "abc123", "purelib",'
+            ' "https://mirror.example.com/wheels/six-1.13.0-py2.py3-none-any.whl"],',
+            output,
+        )
+
+    def test_that_wheels_are_published_to_the_mirror(self):
+        from rules_pygen.rules_generator import RequirementsToBazelLibGenerator
+
+        mirror = os.path.join(self.tmp, "mirror")
+        os.makedirs(mirror)
+        six = self._dependency("six", "1.13.0", {"six.py": ""})
+        foo = self._dependency("foo", "1.0", {"foo.py": "foo"})
+        bar = self._dependency("bar", "1.0", {"bar.py": "bar"})
+        present = os.path.join(mirror, six.wheels[0].filename)
+        shutil.copyfile(six.wheels[0].filepath, present)
+        os.utime(present, (0, 0))
+        # a broken copy of the same size
+        broken = os.path.join(mirror, bar.wheels[0].filename)
+        with open(broken, "wb") as f:
+            f.write(b"x" * os.path.getsize(bar.wheels[0].filepath))
+        gen = RequirementsToBazelLibGenerator(
+            self.reqs, self.tmp, self.bzl, "//3rdparty/python", "37", mirror_dir=mirror
+        )
+        gen._publish_to_mirror({six, foo, bar})
+
+        self.assertEqual(sorted(os.listdir(mirror)), [
+            "bar-1.0-py2.py3-none-any.whl",
+            "foo-1.0-py2.py3-none-any.whl",
+            "six-1.13.0-py2.py3-none-any.whl",
+        ])
+        self.assertEqual(os.path.getmtime(present), 0)
+        for dependency in (foo, bar):
+            with open(os.path.join(mirror, dependency.wheels[0].filename), "rb") as f, \
+                    open(dependency.wheels[0].filepath, "rb") as whl:
+                self.assertEqual(f.read(), whl.read())
+
+    def test_that_wheels_are_added_to_the_repository_cache(self):
+        import hashlib
+        from rules_pygen.rules_generator import RequirementsToBazelLibGenerator
+
+        cache = os.path.join(self.tmp, "repos", "v1")
+        dependency = self._dependency("six", "1.13.0", {"six.py": ""})
+        wheel = dependency.wheels[0]
+        gen = RequirementsToBazelLibGenerator(
+            self.reqs, self.tmp, self.bzl, "//3rdparty/python", "37", repository_cache=cache
+        )
+        gen._seed_repository_cache({dependency})
+        gen._seed_repository_cache({dependency})
+
+        entry_dir = os.path.join(cache, "content_addressable", "sha256", wheel.sha256sum)
+        id_digest = hashlib.sha256(wheel.url.encode("utf-8")).hexdigest()
+        self.assertEqual(sorted(os.listdir(entry_dir)), ["file", "id-" + id_digest])
+        with open(os.path.join(entry_dir, "file"), "rb") as f, open(wheel.filepath, "rb") as whl:
+            self.assertEqual(f.read(), whl.read())
+
+    def test_that_archives_can_be_precompiled(self):
+        output = self._render(precompile=True)
+        self.assertIn(
+            'patch_cmds = ["command -v python3.7 > /dev/null'
+            " || { echo 'precompiling needs python3.7 on the PATH' >&2; exit 1; }; "
+            'python3.7 -m compileall -q -j 0 --invalidation-mode unchecked-hash'
+            ' . > /dev/null || true"],',
+            output,
+        )
+
+    def test_that_precompiling_fails_without_the_interpreter(self):
+        from rules_pygen.rules_generator import PRECOMPILE_CMD
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        with open(os.path.join(tmp, "ok.py"), "w") as f:
+            f.write("x = 1\n")
+        with open(os.path.join(tmp, "py2.py"), "w") as f:
+            f.write("print 'python 2'\n")
+
+        def run(python):
+            cmd = PRECOMPILE_CMD.format(python=python, options="")
+            return subprocess.run(
+                ["bash", "-c", cmd], cwd=tmp, stderr=subprocess.PIPE, universal_newlines=True
+            )
+
+        missing = run("python0.1")
+        self.assertEqual(missing.returncode, 1)
+        self.assertIn("precompiling needs python0.1 on the PATH", missing.stderr)
+        self.assertEqual(run(sys.executable).returncode, 0)
+        # files that don't compile are left without a pyc
+        pycs = os.listdir(os.path.join(tmp, "__pycache__"))
+        self.assertEqual([pyc.split(".")[0] for pyc in pycs], ["ok"])
+
+    def test_that_pruned_files_are_excluded_per_package(self):
+        from rules_pygen.rules_generator import PrunePolicy
+
+        policy = PrunePolicy(["**/tests/**"], {"Big-Package": ["**/*.h"]})
+        output = self._render(prune_policy=policy, deps={
+            self._dependency("six", "1.13.0", {"six.py": ""}),
+            self._dependency("big_package", "1.0", {"big/__init__.py": ""}),
+        })
+        self.assertIn('''    srcs = glob(["**/*.py"], exclude=[
+        "**/tests/**",
+    ]),''', output)
+        self.assertIn('''_BUILD_FILE_CONTENT_BIG_PACKAGE=\'\'\'
+
+py_library(
+    name = "pkg",
+    srcs = glob(["**/*.py"], exclude=[
+        "**/*.h",
+    ]),
+    data = glob(["**/*"], exclude=[
+        "**/*.py", "BUILD", "BUILD.bazel", "WORKSPACE", "*.whl.zip", "**/*.ipynb",
+        "**/*.h"
+    ]),''', output)
+        self.assertIn("build_file_content = _BUILD_FILE_CONTENT_BIG_PACKAGE,", output)
+        self.assertIn("build_file_content = _BUILD_FILE_CONTENT,", output)
+
+    def test_that_build_file_constants_of_similar_names_differ(self):
+        from rules_pygen.rules_generator import PrunePolicy
+
+        policy = PrunePolicy(["**/tests/**"], {"foo.bar": ["**/*.h"], "foo_bar": ["**/*.c"]})
+        output = self._render(prune_policy=policy, deps={
+            self._dependency("foo.bar", "1.0", {"foo/bar.py": ""}),
+            self._dependency("foo_bar", "1.0", {"foo_bar.py": ""}),
+        })
+        self.assertEqual(output.count("\n_BUILD_FILE_CONTENT_FOO_BAR="), 1)
+        self.assertEqual(output.count("\n_BUILD_FILE_CONTENT_FOO_BAR_2="), 1)
+        self.assertIn("build_file_content = _BUILD_FILE_CONTENT_FOO_BAR,", output)
+        self.assertIn("build_file_content = _BUILD_FILE_CONTENT_FOO_BAR_2,", output)
+
+    def test_that_prune_report_counts_removed_files(self):
+        from rules_pygen.rules_generator import PrunePolicy
+
+        report = os.path.join(self.tmp, "report.csv")
+        self._render(prune_policy=PrunePolicy(), prune_report=report, deps={
+            self._dependency("foo", "1.0", {
+                "foo/__init__.py": "x" * 10,
+                "foo/tests/test_foo.py": "x" * 100,
+                "foo/_speedups.c": "x" * 1000,
+                "foo/_speedups.h": "x" * 5,
+            }),
+        })
+        with open(report) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines, [
+            "archive,package,files,bytes,files_removed,bytes_removed",
+            "pypi__foo_1_0,foo,4,1115,3,1105",
+        ])
+
+    def test_that_weight_report_rolls_up_the_closure(self):
+        from rules_pygen.rules_generator import RequirementsToBazelLibGenerator
+
+        app = self._dependency("app", "1.0", {"app.py": "x" * 1000})
+        app.dependencies = ["six"]
+        app.platform_dependencies = {"macos": ["appnope"]}
+        six = self._dependency("six", "1.13.0", {"six.py": "x" * 100, "six.txt": ""})
+        appnope = self._dependency("appnope", "0.1.0", {"appnope.py": "x" * 10})
+        report = os.path.join(self.tmp, "weight.csv")
+        gen = RequirementsToBazelLibGenerator(
+            self.reqs, self.tmp, self.bzl, "//3rdparty/python", "37", weight_report=report
+        )
+        gen._write_weight_report([app, six, appnope])
+
+        with open(report) as f:
+            rows = list(csv.DictReader(f))
+        columns = ["package", "platform", "files", "uncompressed_bytes",
+                   "closure_packages", "closure_files", "closure_uncompressed_bytes"]
+        self.assertEqual([[row[column] for column in columns] for row in rows], [
+            ["app", "macos", "1", "1000", "3", "4", "1110"],
+            ["app", "linux", "1", "1000", "2", "3", "1100"],
+            ["six", "linux", "2", "100", "1", "2", "100"],
+            ["six", "macos", "2", "100", "1", "2", "100"],
+            ["appnope", "linux", "1", "10", "1", "1", "10"],
+            ["appnope", "macos", "1", "10", "1", "1", "10"],
+        ])
+        self.assertEqual(
+            int(rows[0]["closure_compressed_bytes"]),
+            sum(int(row["compressed_bytes"]) for row in rows if row["platform"] == "macos"),
+        )
+
+    def test_that_resolved_extras_get_a_library(self):
+        from rules_pygen.rules_generator import DependencyInfo
+
+        requests = self._dependency("requests", "2.22.0", {"requests/__init__.py": ""})
+        requests.dependencies = ["six"]
+        requests.extras = DependencyInfo("requests", [], {
+            "socks": ["PySocks", "requests"],
+            "security": ["pyOpenSSL"],
+        }).extras
+        output = self._render(deps={
+            requests,
+            self._dependency("six", "1.13.0", {"six.py": ""}),
+            self._dependency("pysocks", "1.7.1", {"socks.py": ""}),
+        })
+
+        self.assertIn('''    py_library(
+        name = "requests__socks",
+        deps = [
+            "requests",
+            "pysocks",
+        ],
+        visibility=["//visibility:public"],
+    )''', output)
+        self.assertNotIn("requests__security", output)
+        self.assertIn('name_key = "{}__{}".format(name_key, extra)', output)
+
+    def test_that_requirement_finds_extras_of_dotted_names(self):
+        ruamel = self._dependency("ruamel.yaml", "0.16.5", {"ruamel/yaml/__init__.py": ""})
+        ruamel.extras = {"Jinja2": [], "old--style.extra": []}
+        output = self._render(deps={ruamel})
+        self.assertIn('name = "ruamel.yaml__jinja2",', output)
+        self.assertIn('name = "ruamel.yaml__old_style_extra",', output)
+
+        # the footer is plain python apart from fail()
+        def fail(message):
+            raise ValueError(message)
+
+        namespace = {"fail": fail}
+        exec(output[output.index("def requirement("):], namespace)
+        requirement = namespace["requirement"]
+        self.assertEqual(requirement("ruamel.yaml"), "//3rdparty/python:ruamel.yaml")
+        self.assertEqual(
+            requirement("ruamel.yaml[jinja2]"), "//3rdparty/python:ruamel.yaml__jinja2"
+        )
+        self.assertEqual(
+            requirement("ruamel.yaml[old--style.extra]"),
+            "//3rdparty/python:ruamel.yaml__old_style_extra",
+        )
+        with self.assertRaisesRegex(ValueError, "one extra at a time"):
+            requirement("ruamel.yaml[jinja2,old]")
+
+    def test_that_site_packages_layout_uses_a_single_repository(self):
+        output = self._render(layout="site-packages", deps={
+            self._dependency("six", "1.13.0", {
+                "six.py": "", "six-1.13.0.dist-info/METADATA": "",
+            }),
+            self._dependency("google_auth", "1.0", {
+                "google/auth/__init__.py": "", "google_auth-1.0.dist-info/METADATA": "",
+            }),
+            self._dependency("protobuf", "3.0", {
+                "google/protobuf/__init__.py": "", "protobuf-3.0.dist-info/METADATA": "",
+            }),
+        })
+        self.assertNotIn("http_archive(", output)
+        self.assertIn('''        _pypi_site_packages(
+            name = "pypi__site_packages__3rdparty_python",
+            wheels = {
+                "pypi__google_auth_1_0": ["https://example.org/google_auth-1.0-py2.py3-none-any.whl", "''', output)
+        self.assertIn('+ ["@pypi__site_packages__3rdparty_python//:six"],', output)
+        self.assertIn('''py_library(
+    name = "six",
+    srcs = glob(["six.py", "six-1.13.0.dist-info/**/*.py"]),
+    data = glob(["six-1.13.0.dist-info/**"], exclude=[
+        "**/*.py"
+    ]),
+    imports = ["."],''', output)
+        # the shared namespace package is split up between its distributions
+        self.assertIn(
+            'srcs = glob(["google/protobuf/**/*.py", "protobuf-3.0.dist-info/**/*.py"]),', output
+        )
+        self.assertIn(
+            'srcs = glob(["google/auth/**/*.py", "google_auth-1.0.dist-info/**/*.py"]),', output
+        )
+
+
+class WhenPruningFilesTest(unittest.TestCase):
+
+    def test_that_globs_match_like_bazel(self):
+        from rules_pygen.rules_generator import _glob_to_re
+
+        tests = _glob_to_re("**/tests/**")
+        self.assertTrue(tests.match("tests/test_foo.py"))
+        self.assertTrue(tests.match("foo/bar/tests/data/x.json"))
+        self.assertFalse(tests.match("foo/tests.py"))
+        self.assertFalse(tests.match("foo/mytests/x.py"))
+
+        headers = _glob_to_re("**/*.h")
+        self.assertTrue(headers.match("foo.h"))
+        self.assertTrue(headers.match("numpy/core/include/foo.h"))
+        self.assertFalse(headers.match("foo.hpp"))
+
+        top_level = _glob_to_re("*.txt")
+        self.assertTrue(top_level.match("LICENSE.txt"))
+        self.assertFalse(top_level.match("foo/LICENSE.txt"))
+
+    def test_that_policy_is_read_from_file(self):
+        from rules_pygen.rules_generator import (
+            DEFAULT_PRUNE_PATTERNS, PrunePolicy, PyBazelRuleGeneratorException
+        )
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, "prune.json")
+        with open(path, "w") as f:
+            f.write('{"packages": {"NumPy": []}}')
+        policy = PrunePolicy.from_file(path)
+        self.assertEqual(policy.patterns("six"), DEFAULT_PRUNE_PATTERNS)
+        self.assertEqual(policy.patterns("numpy"), ())
+        self.assertEqual(policy.pruned("numpy", ["numpy/tests/x.py"]), [])
+        self.assertEqual(policy.pruned("six", ["six/tests/x.py", "six.py"]), ["six/tests/x.py"])
+
+        with open(path, "w") as f:
+            f.write('{"package": {}}')
+        with self.assertRaises(PyBazelRuleGeneratorException):
+            PrunePolicy.from_file(path)
+
+
+class WhenIndexingModulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _wheel(self, filename, files):
+        path = os.path.join(self.tmp, filename)
+        with zipfile.ZipFile(path, "w") as zf:
+            for name, content in files.items():
+                zf.writestr(name, content)
+        return path
+
+    def test_that_metadata_is_read_once_for_all_extras(self):
+        from rules_pygen.wheeltool import Wheel
+
+        path = self._wheel("foo-1.0-py3-none-any.whl", {
+            "foo.py": "",
+            "foo-1.0.dist-info/METADATA": "\n".join([
+                "Name: foo",
+                "Version: 1.0",
+                "Requires-Dist: six",
+                'Requires-Dist: pysocks; extra == "socks"',
+                'Requires-Dist: pyopenssl; extra == "security"',
+            ]),
+        })
+        wheel = Wheel(path)
+        with unittest.mock.patch(
+            "rules_pygen.wheeltool.zipfile.ZipFile", side_effect=zipfile.ZipFile
+        ) as mock_zipfile:
+            self.assertEqual(wheel.name(), "foo")
+            self.assertEqual(list(wheel.dependencies()), ["six"])
+            extras = {extra: list(wheel.dependencies(extra=extra)) for extra in wheel.extras()}
+        self.assertEqual(extras, {"socks": ["pysocks"], "security": ["pyopenssl"]})
+        self.assertEqual(mock_zipfile.call_count, 1)
+
+    def test_that_top_level_txt_is_used(self):
+        from rules_pygen.wheeltool import Wheel
+
+        path = self._wheel("python_dateutil-2.8.1-py2.py3-none-any.whl", {
+            "dateutil/__init__.py": "",
+            "python_dateutil-2.8.1.dist-info/top_level.txt": "dateutil\n",
+        })
+        self.assertEqual(Wheel(path).top_level_modules(), ["dateutil"])
+
+    def test_that_modules_are_found_without_top_level_txt(self):
+        from rules_pygen.wheeltool import Wheel
+
+        path = self._wheel("six-1.13.0-py2.py3-none-any.whl", {
+            "six.py": "",
+            "_six_speedups.cpython-37m-x86_64-linux-gnu.so": "",
+            "six-1.13.0.dist-info/RECORD": "",
+        })
+        self.assertEqual(Wheel(path).top_level_modules(), ["_six_speedups", "six"])
+
+    def test_that_namespace_packages_are_indexed_by_subpackage(self):
+        from rules_pygen.wheeltool import Wheel
+
+        path = self._wheel("protobuf-3.0-py2.py3-none-any.whl", {
+            "google/protobuf/__init__.py": "",
+            "protobuf-3.0.dist-info/top_level.txt": "google\n",
+        })
+        self.assertEqual(Wheel(path).top_level_modules(), ["google.protobuf"])
+
+    def test_that_the_index_is_written(self):
+        from rules_pygen.rules_generator import DependencyInfo, RequirementsToBazelLibGenerator
+
+        protobuf = DependencyInfo("protobuf", ["six"], {})
+        protobuf.modules = ["google.protobuf"]
+        six = DependencyInfo("six", [], {})
+        six.modules = ["six"]
+        index_path = os.path.join(self.tmp, "modules.json")
+        gen = RequirementsToBazelLibGenerator(
+            None, None, None, "//3rdparty/python", "37", module_index=index_path
+        )
+        gen._write_module_index({protobuf, six})
+        with open(index_path) as f:
+            self.assertEqual(json.load(f), {
+                "modules": {"google.protobuf": ["protobuf"], "six": ["six"]},
+                "dependencies": {"protobuf": ["six"], "six": []},
+            })
+
+
+class WhenReusingTheWheelDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.wheel_dir = os.path.join(self.tmp, "wheels")
+        os.makedirs(self.wheel_dir)
+        self.reqs = os.path.join(self.tmp, "requirements.txt")
+        with open(self.reqs, "w") as f:
+            f.write("six==1.13.0\n")
+
+    def _wheel(self, filename, size=10, mtime=None):
+        from rules_pygen.rules_generator import WHEEL_FILE_RE
+
+        path = os.path.join(self.wheel_dir, filename)
+        name = WHEEL_FILE_RE.search(filename).group("namever")
+        with zipfile.ZipFile(path, "w") as zf:
+            zf.writestr(name + ".dist-info/METADATA", "Name: {}\n".format(filename.split("-")[0]))
+            zf.writestr("data", "x" * size)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def _generator(self, **kwargs):
+        from rules_pygen.rules_generator import RequirementsToBazelLibGenerator
+
+        return RequirementsToBazelLibGenerator(
+            self.reqs, self.wheel_dir, os.path.join(self.tmp, "requirements.bzl"),
+            "//3rdparty/python", "37", **kwargs
+        )
+
+    def test_that_only_wheels_from_pip_are_processed(self):
+        self._wheel("six-1.12.0-py2.py3-none-any.whl")  # from an earlier run
+        self._wheel("six-1.13.0-py2.py3-none-any.whl")
+        self._wheel("idna-2.8-py2.py3-none-any.whl")
+        self._wheel("coolname-1.1.0-py2.py3-none-any.whl")
+        gen = self._generator()
+        out = "\n".join([
+            "  Found link https://example.org/{}, version: 1".format(filename)
+            for filename in os.listdir(self.wheel_dir)
+        ] + [
+            "  File was already downloaded {}/six-1.13.0-py2.py3-none-any.whl".format(
+                self.wheel_dir
+            ),
+            "  Saved ./idna-2.8-py2.py3-none-any.whl",
+            "  Created wheel for coolname: filename=coolname-1.1.0-py2.py3-none-any.whl"
+            " size=35000 sha256=abc",
+        ])
+        with unittest.mock.patch.object(gen, "_call_pip", return_value=out):
+            wheel_links, wheel_filenames = gen._get_wheel_links()
+        self.assertEqual(wheel_filenames, [
+            "coolname-1.1.0-py2.py3-none-any.whl",
+            "idna-2.8-py2.py3-none-any.whl",
+            "six-1.13.0-py2.py3-none-any.whl",
+        ])
+
+        deps = gen._parse_wheel_dependencies(wheel_links, wheel_filenames)
+        self.assertEqual(
+            sorted(wheel.filename for dependency in deps for wheel in dependency.wheels),
+            wheel_filenames,
+        )
+
+    def test_that_unused_wheels_beyond_the_budget_are_removed(self):
+        from rules_pygen.rules_generator import DependencyInfo, WheelInfo
+
+        used = self._wheel("six-1.13.0-py2.py3-none-any.whl", mtime=1000)
+        recent = self._wheel("six-1.12.0-py2.py3-none-any.whl", size=2000, mtime=3000)
+        older = self._wheel("six-1.11.0-py2.py3-none-any.whl", size=2000, mtime=2000)
+        oldest = self._wheel("idna-2.7-py2.py3-none-any.whl", mtime=1000)
+        six = DependencyInfo("six", [], {})
+        six.add_wheel(WheelInfo(used, "https://example.org/six", "six", "1.13.0"))
+
+        budget = os.path.getsize(recent) + os.path.getsize(oldest)
+        self._generator(wheel_dir_budget=budget)._collect_wheels({six})
+
+        # the newest unused wheel fits, the next doesn't, the ones after it are gone too
+        self.assertEqual(
+            sorted(os.listdir(self.wheel_dir)),
+            ["six-1.12.0-py2.py3-none-any.whl", "six-1.13.0-py2.py3-none-any.whl"],
+        )
+        self.assertGreater(os.path.getmtime(used), 1000)
+        self.assertFalse(os.path.exists(older))
+
+
+    def test_that_partial_downloads_are_removed(self):
+        from rules_pygen.rules_generator import DependencyInfo, WheelInfo
+
+        used = self._wheel("six-1.13.0-py2.py3-none-any.whl")
+        with open(os.path.join(self.wheel_dir, "idna-2.8-py2.py3-none-any.whl.part"), "w") as f:
+            f.write("interrupted")
+        six = DependencyInfo("six", [], {})
+        six.add_wheel(WheelInfo(used, "https://example.org/six", "six", "1.13.0"))
+
+        self._generator(wheel_dir_budget=10 ** 6)._collect_wheels({six})
+
+        self.assertEqual(os.listdir(self.wheel_dir), ["six-1.13.0-py2.py3-none-any.whl"])
+
+class WhenResolvingWithPipReportsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.reqs = os.path.join(self.tmp, "requirements.txt")
+        with open(self.reqs, "w") as f:
+            f.write("app==1.0\ncffi==1.14.0\n")
+
+    def test_that_reports_are_parsed(self):
+        from rules_pygen.rules_generator import _parse_pip_report, PLATFORM_MARKER_ENVIRONMENTS
+        from . import fakes
+
+        app = fakes.report_item("App-1.0-py3-none-any.whl", "App", [
+            "six (>=1.5)",
+            'appnope; sys_platform == "darwin"',
+            'pytest; extra == "testing"',
+            'pytest-xdist; extra == "testing" and sys_platform == "linux"',
+        ])
+        app["metadata"]["provides_extra"] = ["testing"]
+        report = {"version": "1", "install": [
+            fakes.report_item("six-1.13.0-py2.py3-none-any.whl", "six", digest="ab" * 32),
+            app,
+            {
+                "download_info": {
+                    "url": "https://files.example.org/packages/mock-2.0.0-py2.py3-none-any.whl",
+                    "archive_info": {"hash": "md5=abcdef"},
+                },
+                "metadata": {"name": "mock"},
+            },
+        ]}
+        linux = _parse_pip_report(report, PLATFORM_MARKER_ENVIRONMENTS["linux"])
+        macos = _parse_pip_report(report, PLATFORM_MARKER_ENVIRONMENTS["macos"])
+
+        self.assertEqual(sorted(linux), ["app", "mock", "six"])
+        self.assertEqual(linux["six"].digest, ("sha256", "ab" * 32))
+        self.assertEqual(linux["six"].version, "1.13.0")
+        self.assertEqual(
+            linux["six"].url, "https://files.example.org/packages/six-1.13.0-py2.py3-none-any.whl"
+        )
+        self.assertEqual(linux["mock"].digest, ("md5", "abcdef"))
+        self.assertEqual(linux["app"].requires, {"six"})
+        self.assertEqual(macos["app"].requires, {"six", "appnope"})
+        self.assertEqual(linux["app"].extras, {"testing": {"pytest", "pytest_xdist"}})
+        self.assertEqual(macos["app"].extras, {"testing": {"pytest"}})
+
+    def test_that_markers_use_the_environment_of_the_report(self):
+        from rules_pygen.rules_generator import _parse_pip_report, PLATFORM_MARKER_ENVIRONMENTS
+        from . import fakes
+
+        report = {
+            "version": "1",
+            "environment": {
+                "python_version": "3.7",
+                "python_full_version": "3.7.9",
+                "sys_platform": "darwin",
+                "platform_system": "Darwin",
+                "os_name": "posix",
+            },
+            "install": [fakes.report_item("app-1.0-py3-none-any.whl", "app", [
+                'importlib-metadata; python_version < "3.8"',
+                'typing-extensions; python_version >= "3.8"',
+                'appnope; sys_platform == "darwin"',
+            ])],
+        }
+        linux = _parse_pip_report(report, PLATFORM_MARKER_ENVIRONMENTS["linux"])
+
+        self.assertEqual(linux["app"].requires, {"importlib_metadata"})
+
+    def test_that_sdists_are_rejected(self):
+        from rules_pygen.rules_generator import _parse_pip_report, PyBazelRuleGeneratorException
+        from . import fakes
+
+        with self.assertRaises(PyBazelRuleGeneratorException):
+            _parse_pip_report(
+                {"install": [fakes.report_item("coolname-1.1.0.tar.gz", "coolname")]}
+            )
+
+    def _resolve(self, reports):
+        from rules_pygen.rules_generator import RequirementsToBazelLibGenerator
+        from . import fakes
+
+        calls = []
+
+        def call_pip(args, marker_environment):
+            platform = "macos" if marker_environment["sys_platform"] == "darwin" else "linux"
+            calls.append((platform, args))
+            fakes.write_report(args, reports[platform])
+            return ""
+
+        gen = RequirementsToBazelLibGenerator(
+            self.reqs, self.tmp, os.path.join(self.tmp, "requirements.bzl"),
+            "//3rdparty/python", "37", resolver="pip-report",
+        )
+        with unittest.mock.patch.object(gen, "_call_pip", side_effect=call_pip), \
+                unittest.mock.patch("rules_pygen.rules_generator._download", fakes.download):
+            deps = gen._resolve_platforms()
+        return gen, {d.name: d for d in deps}, calls
+
+    def test_that_platforms_are_resolved_and_merged(self):
+        from . import fakes
+
+        app = ["six", 'appnope; sys_platform == "darwin"']
+        gen, deps, calls = self._resolve({
+            "linux": [
+                fakes.report_item("app-1.0-py3-none-any.whl", "app", app),
+                fakes.report_item("six-1.13.0-py2.py3-none-any.whl", "six"),
+                fakes.report_item("cffi-1.14.0-cp37-cp37m-manylinux1_x86_64.whl", "cffi"),
+            ],
+            "macos": [
+                fakes.report_item("app-1.0-py3-none-any.whl", "app", app),
+                fakes.report_item("six-1.13.0-py2.py3-none-any.whl", "six"),
+                fakes.report_item("appnope-0.1.0-cp37-cp37m-macosx_10_9_x86_64.whl", "appnope"),
+                fakes.report_item("cffi-1.14.0-cp37-cp37m-macosx_10_9_x86_64.whl", "cffi"),
+            ],
+        })
+
+        self.assertEqual(sorted(platform for platform, _ in calls), ["linux", "macos"])
+        for platform, args in calls:
+            self.assertIn("--dry-run", args)
+            self.assertIn("--only-binary=:all:", args)
+            self.assertIn("--platform", args)
+
+        self.assertEqual(sorted(deps), ["app", "appnope", "cffi", "six"])
+        self.assertEqual(deps["app"].dependencies, ["six"])
+        self.assertEqual(deps["app"].platform_dependencies, {"macos": ["appnope"]})
+        self.assertEqual([w.platform for w in deps["cffi"].wheels], ["linux", "macos"])
+        self.assertEqual(deps["six"].modules, ["six"])
+
+        output = gen.render(set(deps.values()))
+        self.assertIn('''        name = "app",
+        deps = [
+            "six",
+        ] + select({
+            "@//tool_bazel:linux": [],
+            "@//tool_bazel:macos": ["appnope"],
+        }) + ["@pypi__app_1_0//:pkg"],''', output)
+        self.assertIn('''        name = "appnope",
+        deps = [
+        ] + select({
+            "@//tool_bazel:linux": [],
+            "@//tool_bazel:macos": ["@pypi__appnope_0_1_0__macos//:pkg"],
+        }),''', output)
+
+    def test_that_platforms_must_agree_on_versions(self):
+        from rules_pygen.rules_generator import PyBazelRuleGeneratorException
+        from . import fakes
+
+        with self.assertRaises(PyBazelRuleGeneratorException):
+            self._resolve({
+                "linux": [fakes.report_item("six-1.13.0-py2.py3-none-any.whl", "six")],
+                "macos": [fakes.report_item("six-1.12.0-py2.py3-none-any.whl", "six")],
+            })